@@ -0,0 +1,317 @@
+from fractions import Fraction
+import itertools
+import magic_items
+import spells
+import string
+
+# Names are counted and enumerated on the assumption that each one splits back into
+# its slots in only one way for a given template string, which holds as long as no
+# table entry contains the text around its slot (like " of (the) " or "'s ").
+# Exact probabilities don't rely on this: probability() tries every way to split a
+# name.
+
+
+def table_distribution(table):
+    """
+    Returns a dictionary mapping each distinct entry in a table to the exact
+    probability of drawing it.
+    """
+    total = sum(table.weights)
+    distribution = {}
+    for entry, weight in zip(table.entries, table.weights):
+        distribution[entry] = distribution.get(entry, 0) + Fraction(weight, total)
+
+    return distribution
+
+
+def wizard_name_distribution(generator, table_names):
+    """
+    Returns a dictionary mapping each distinct wizard name to the exact probability
+    of generating it, adding up every prefix and suffix pair that spells it.
+    """
+    prefixes = table_distribution(generator.tables[table_names.WIZARD_NAME_PRE])
+    suffixes = table_distribution(generator.tables[table_names.WIZARD_NAME_POST])
+
+    distribution = {}
+    for prefix, prefix_chance in prefixes.items():
+        for suffix, suffix_chance in suffixes.items():
+            wizard = prefix.strip("-") + suffix.strip("-")
+            chance = prefix_chance * suffix_chance
+            distribution[wizard] = distribution.get(wizard, 0) + chance
+
+    return distribution
+
+
+class TemplateSpace:
+    """
+    Every name one template can produce: the distribution of text for each of the
+    template's slots, plus the chance of the template being chosen at all.
+    """
+
+    def __init__(self, kind, index, template_string, probability, slots):
+        self.kind = kind
+        self.index = index
+        self.string = template_string
+        self.probability = probability
+        self.slots = slots
+        # The literal text before, between and after the slots.
+        self.literals = [
+            literal for literal, _, _, _ in string.Formatter().parse(template_string)]
+        if len(self.literals) == len(slots):
+            self.literals.append("")
+
+    def cardinality(self):
+        """
+        Returns the number of distinct combinations of slot values.
+        """
+        count = 1
+        for slot in self.slots:
+            count *= len(slot)
+
+        return count
+
+    def combinations(self):
+        """
+        Yields every combination of slot values, one tuple at a time.
+        """
+        return itertools.product(*self.slots)
+
+    def contains(self, values):
+        """
+        Returns true if this template can produce the given slot values.
+        """
+        return all(value in slot for value, slot in zip(values, self.slots))
+
+    def render(self, values):
+        """
+        Returns the name made from the given slot values.
+        """
+        return self.string.format(*values)
+
+    def values_probability(self, values):
+        """
+        Returns the exact probability of generating the given slot values from this
+        space, including the chance of choosing this template.
+        """
+        probability = self.probability
+        for value, slot in zip(values, self.slots):
+            probability *= slot.get(value, 0)
+
+        return probability
+
+    def name_probability(self, name):
+        """
+        Returns the exact probability of generating name from this space, adding up
+        every way the name could be split into slot values.
+        """
+        if not name.startswith(self.literals[0]):
+            return Fraction(0)
+
+        return self.probability * self._match(name, len(self.literals[0]), 0)
+
+    def _match(self, name, position, slot_index):
+        """
+        Returns the total probability of every way the rest of name, from position
+        on, fills the slots from slot_index on.
+        """
+        slot = self.slots[slot_index]
+        following = self.literals[slot_index + 1]
+        last = slot_index == len(self.slots) - 1
+
+        # The last slot has to run right up to the closing literal text.
+        if last:
+            if not name.endswith(following):
+                return Fraction(0)
+            value = name[position:len(name) - len(following)]
+            return slot.get(value, Fraction(0))
+
+        total = Fraction(0)
+        end = name.find(following, position)
+        while end != -1:
+            value = name[position:end]
+            if value in slot:
+                total += slot[value] * self._match(
+                    name, end + len(following), slot_index + 1)
+            end = name.find(following, end + 1)
+
+        return total
+
+
+class NameSpace:
+    """
+    Every name a generator can produce, as a set of template spaces.
+
+    Templates with the same template string can produce the same names, so those
+    are grouped together when counting and enumerating names.
+    """
+
+    def __init__(self, templates):
+        self.templates = templates
+
+        self.groups = {}
+        for template in templates:
+            self.groups.setdefault(template.string, []).append(template)
+
+    def template_cardinalities(self):
+        """
+        Returns a list of (kind, template index, number of combinations) for each
+        template in the space.
+        """
+        return [
+            (template.kind, template.index, template.cardinality())
+            for template in self.templates
+        ]
+
+    def cardinality(self):
+        """
+        Returns the number of distinct names in the space.
+        """
+        return sum(union_size(group) for group in self.groups.values())
+
+    def probability(self, name):
+        """
+        Returns the exact probability of generating name.
+        """
+        return sum(
+            (template.name_probability(name) for template in self.templates),
+            Fraction(0))
+
+    def names(self):
+        """
+        Yields (name, probability) for every distinct name in the space, without
+        holding more than one name at a time in memory.
+        """
+        for group in self.groups.values():
+            for position, template in enumerate(group):
+                earlier = group[:position]
+                for values in template.combinations():
+                    # A name an earlier template in the group can also produce has
+                    # already been yielded, with this template's share included.
+                    if any(other.contains(values) for other in earlier):
+                        continue
+
+                    probability = sum(
+                        other.values_probability(values) for other in group[position:])
+                    yield template.render(values), probability
+
+
+def union_size(group):
+    """
+    Returns the number of distinct slot value combinations across a group of
+    template spaces that share a template string.
+    """
+    # By inclusion-exclusion, the union is the sum over every non-empty subset of
+    # templates of +/- the size of their intersection, and the intersection of two
+    # products of sets is the product of the slot-by-slot intersections. Once an
+    # intersection is empty, so is every larger one, so we stop looking there.
+    def visit(start, slots):
+        total = 0
+        for index in range(start, len(group)):
+            if slots is None:
+                shared = [set(slot) for slot in group[index].slots]
+            else:
+                shared = [
+                    slot & other.keys()
+                    for slot, other in zip(slots, group[index].slots)
+                ]
+
+            count = 1
+            for slot in shared:
+                count *= len(slot)
+            if count:
+                total += count - visit(index + 1, shared)
+
+        return total
+
+    return visit(0, None)
+
+
+def spell_space(spell_gen):
+    """
+    Returns the NameSpace of every spell name spell_gen can produce.
+    """
+    return NameSpace(spell_templates(spell_gen))
+
+
+def spell_templates(spell_gen, kind="SPELL", chance=Fraction(1), prefix=""):
+    """
+    Returns a TemplateSpace for each spell name template, each chosen with the given
+    overall chance and with prefix put in front of its template string.
+    """
+    template_chances = table_distribution(spells.SPELL_NAME_TEMPLATE_TABLE)
+    wizard_names = None
+
+    spaces = []
+    for index, template in enumerate(spells.SPELL_NAME_TEMPLATES):
+        slots = []
+        wizard_slot = False
+        for table in template.fields:
+            # As when generating, the wizard name prefix and suffix share one slot.
+            if spell_gen.is_wizard_name(table, spells.Spell_Tables):
+                if not wizard_slot:
+                    if wizard_names is None:
+                        wizard_names = wizard_name_distribution(
+                            spell_gen, spells.Spell_Tables)
+                    slots.append(wizard_names)
+                    wizard_slot = True
+            else:
+                slots.append(table_distribution(spell_gen.tables[table]))
+
+        spaces.append(TemplateSpace(
+            kind,
+            index,
+            prefix + template.string,
+            chance * template_chances[template],
+            slots))
+
+    return spaces
+
+
+def item_space(item_gen, item_type=None):
+    """
+    Returns the NameSpace of every magic item name item_gen can produce, either for
+    one M_Item type or, if item_type is None, for randomly chosen items of any type.
+    """
+    if item_type is None:
+        type_chances = table_distribution(item_gen.item_types)
+    else:
+        type_chances = {item_type: Fraction(1)}
+
+    template_chances = table_distribution(magic_items.M_ITEM_TEMPLATE_TABLE)
+    wizard_names = None
+
+    spaces = []
+    for general_item_type, type_chance in type_chances.items():
+        kind = general_item_type.name
+
+        # Scrolls are a spell name with "Scroll of " in front.
+        if general_item_type == magic_items.M_Item.SCROLL:
+            spaces.extend(spell_templates(
+                item_gen.spell_gen, kind, type_chance, "Scroll of "))
+            continue
+
+        items = table_distribution(item_gen.items[general_item_type])
+        for index, template in enumerate(magic_items.M_ITEM_TEMPLATES):
+            slots = []
+            wizard_slot = False
+            for table in template.fields:
+                if item_gen.is_wizard_name(table, magic_items.M_ItemName):
+                    if not wizard_slot:
+                        if wizard_names is None:
+                            wizard_names = wizard_name_distribution(
+                                item_gen, magic_items.M_ItemName)
+                        slots.append(wizard_names)
+                        wizard_slot = True
+                elif table == magic_items.M_ItemName.ITEM:
+                    slots.append(items)
+                else:
+                    slots.append(table_distribution(item_gen.tables[table]))
+
+            spaces.append(TemplateSpace(
+                kind,
+                index,
+                template.string,
+                type_chance * template_chances[template],
+                slots))
+
+    return NameSpace(spaces)
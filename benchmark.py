@@ -0,0 +1,336 @@
+import click
+import json
+import magic_items
+import os
+import packs
+import platform
+import shutil
+import spells
+import subprocess
+import sys
+import table_cache
+import tempfile
+import timeit
+import tools
+import tracemalloc
+
+# How much slower than the baseline a benchmark can get before it counts as a
+# regression. Timings on a shared machine are noisy, so this is forgiving: the
+# regressions worth catching here tend to be twofold or worse.
+DEFAULT_TOLERANCE = 0.5
+
+# How many names the end-to-end CLI benchmark generates.
+CLI_NUM_ITEMS = 100000
+
+BASELINE_FILENAME = "bench_baseline.json"
+
+
+def time_per_call(function, repeat=5):
+    """
+    Returns the best time, in seconds, that one call to function took, over several
+    rounds of enough calls to take a fair fraction of a second.
+    """
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def calibration():
+    """
+    Times a fixed bit of pure Python work, so results from runs on busier or slower
+    machines can be scaled to be comparable.
+    """
+    return time_per_call(lambda: sorted(str(number) for number in range(1000)))
+
+
+def table_loading_benchmarks():
+    """
+    Times loading the spell tables in each of the ways they can be loaded.
+    """
+    json_filename = spells.SPELL_PACK.json_filename
+    text_filename = tools.text_filename(json_filename)
+    fields = spells.Spell_Tables
+    results = {}
+
+    def load_shared():
+        return tools.shared_tables(
+            json_filename,
+            fields,
+            sources=[text_filename],
+            reader=lambda: tools.read_tables(text_filename, fields))
+
+    def load_shared_cold():
+        tools.reload_tables(json_filename)
+        return load_shared()
+
+    results["load_tables_json"] = time_per_call(
+        lambda: tools.load_tables(json_filename, fields))
+    results["shared_tables_cold"] = time_per_call(load_shared_cold)
+    results["shared_tables_warm"] = time_per_call(load_shared)
+
+    def load_shared_cold_lazy():
+        tools.use_lazy_entries()
+        try:
+            return load_shared_cold()
+        finally:
+            tools.use_lazy_entries(False)
+
+    results["shared_tables_cold_lazy"] = time_per_call(load_shared_cold_lazy)
+    # Leave the shared tables as every other benchmark expects to find them.
+    tools.reload_tables(json_filename)
+
+    # Building and compiling from scratch writes files, so we'll do it somewhere we
+    # can throw away.
+    scratch = tempfile.mkdtemp()
+    try:
+        scratch_json = os.path.join(scratch, "Spells.json")
+        scratch_text = tools.text_filename(scratch_json)
+        scratch_cache = tools.cache_filename(scratch_json)
+        shutil.copy(text_filename, scratch_text)
+
+        def compile_cold():
+            if os.path.exists(scratch_cache):
+                os.remove(scratch_cache)
+            return table_cache.load_tables(
+                scratch_cache,
+                [scratch_text],
+                fields,
+                lambda: tools.read_tables(scratch_text, fields))
+
+        results["build_tables"] = time_per_call(
+            lambda: tools.build_tables(scratch_json, fields))
+        results["compiled_tables_cold"] = time_per_call(compile_cold)
+    finally:
+        shutil.rmtree(scratch)
+
+    return results
+
+
+def draw_benchmarks():
+    """
+    Times single draws from small and large tables, and generating single names.
+    """
+    item_gen = magic_items.M_Item_Generator()
+    spell_gen = item_gen.spell_gen
+    results = {}
+
+    tables = {
+        "wand": item_gen.items[magic_items.M_Item.WAND],
+        "magic_item_adjective": item_gen.tables[magic_items.M_ItemName.ADJECTIVE],
+        "magic_item_noun": item_gen.tables[magic_items.M_ItemName.NOUN],
+    }
+    for name, table in tables.items():
+        results["table_random_{}".format(name)] = time_per_call(table.random)
+
+    results["spell"] = time_per_call(spell_gen.spell)
+    results["magic_item"] = time_per_call(item_gen.magic_item)
+
+    spell_names = spells.Spell_Tables
+    results["wizard_name"] = time_per_call(
+        lambda: spell_gen.generate_wizard_name(spell_names))
+    pooled_gen = spells.Spell_Generator(wizard_pool=True)
+    # Build the pool before timing, so only the draws are timed.
+    pooled_gen.wizard_name_pool(spell_names)
+    results["wizard_name_pooled"] = time_per_call(
+        lambda: pooled_gen.generate_wizard_name(spell_names))
+    results["spell_pooled"] = time_per_call(pooled_gen.spell)
+    for item_type in magic_items.M_Item:
+        results["specific_item_{}".format(item_type.name.lower())] = time_per_call(
+            lambda: item_gen.specific_item(item_type))
+
+    return results
+
+
+def memory_benchmarks():
+    """
+    Measures how much memory the tables take up, in bytes: how much loading every
+    registered table pack allocates (with and without lazy entries), and how much
+    the loaded Table objects hold altogether.
+    """
+    results = {}
+
+    for name, lazy in [("load_all_tables", False), ("load_all_tables_lazy", True)]:
+        tools.use_lazy_entries(lazy)
+        tools.reload_tables()
+        tracemalloc.start()
+        try:
+            for pack in packs.registered_packs():
+                pack.tables()
+            results[name], _ = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+            tools.use_lazy_entries(False)
+
+    tools.reload_tables()
+    all_tables = [
+        table for pack in packs.registered_packs() for table in pack.tables().values()]
+    results["table_objects"] = deep_size(all_tables)
+
+    return results
+
+
+def deep_size(all_tables):
+    """
+    Returns the bytes held by a list of tables: the Table objects, their entries,
+    weights and running totals, counting anything shared between them only once.
+    Memory mapped from compiled table files isn't counted.
+    """
+    seen = set()
+    total = 0
+
+    def add(thing):
+        nonlocal total
+        if id(thing) not in seen:
+            seen.add(id(thing))
+            total += sys.getsizeof(thing)
+
+    for table in all_tables:
+        add(table)
+        for part in [table.entries, table.weights, table.cumulative_weights()]:
+            add(part)
+            if isinstance(part, (list, tuple)):
+                for item in part:
+                    add(item)
+
+    return total
+
+
+def cli_benchmarks():
+    """
+    Times generating CLI_NUM_ITEMS items end to end with the command line tool,
+    including starting Python and loading the tables.
+    """
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "perilous_gen.py")
+    command = [sys.executable, script, "item", str(CLI_NUM_ITEMS), "--stream"]
+
+    def run():
+        subprocess.run(
+            command,
+            check=True,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL)
+
+    # Each run takes long enough that a couple of rounds is plenty.
+    seconds = min(timeit.repeat(run, repeat=3, number=1))
+    return {"cli_item_{}".format(CLI_NUM_ITEMS): seconds}
+
+
+def run_benchmarks(include_cli=True):
+    """
+    Runs every benchmark, returning the results along with details of the machine
+    they were run on.
+    """
+    results = {}
+    results.update(table_loading_benchmarks())
+    results.update(draw_benchmarks())
+    if include_cli:
+        results.update(cli_benchmarks())
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "calibration": calibration(),
+        "seconds": results,
+        "bytes": memory_benchmarks(),
+    }
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE, measure="seconds"):
+    """
+    Returns a list of (name, baseline value, current value, ratio, regressed)
+    tuples for every benchmark found in both results and baseline, comparing either
+    their "seconds" or their "bytes".
+
+    Timing ratios are scaled by how the two runs' calibration timings compare, so a
+    uniformly slower machine doesn't look like a regression.
+    """
+    if measure == "seconds":
+        scale = baseline["calibration"] / results["calibration"]
+    else:
+        scale = 1
+
+    comparison = []
+    baseline_values = baseline.get(measure, {})
+    for name, value in sorted(results[measure].items()):
+        if name not in baseline_values:
+            continue
+        base = baseline_values[name]
+        ratio = value * scale / base if base else float("inf")
+        comparison.append((name, base, value, ratio, ratio > 1 + tolerance))
+
+    return comparison
+
+
+@click.command()
+@click.option("-o", "--output", "output_file", type=click.Path(dir_okay=False),
+              help="Write the results to this JSON file.")
+@click.option("-b", "--baseline", type=click.Path(dir_okay=False),
+              default=BASELINE_FILENAME, show_default=True,
+              help="Compare against the results stored in this JSON file.")
+@click.option("--save-baseline", is_flag=True,
+              help="Store these results as the new baseline.")
+@click.option("--tolerance", type=float, default=DEFAULT_TOLERANCE, show_default=True,
+              help="How much slower (as a fraction) counts as a regression.")
+@click.option("--no-cli", is_flag=True,
+              help="Skip the end-to-end command line benchmark.")
+def bench(output_file, baseline, save_baseline, tolerance, no_cli):
+    """
+    Benchmark table loading, table draws, name generation and the command line tool,
+    and measure how much memory the tables take up.
+
+    Exits with status 1 if anything is slower than the baseline by more than the
+    tolerance.
+    """
+    results = run_benchmarks(include_cli=not no_cli)
+
+    if output_file:
+        with open(output_file, "w") as file:
+            json.dump(results, file, indent=2, sort_keys=True)
+    else:
+        click.echo(json.dumps(results, indent=2, sort_keys=True))
+
+    if save_baseline:
+        with open(baseline, "w") as file:
+            json.dump(results, file, indent=2, sort_keys=True)
+        click.echo("Saved baseline to {}".format(baseline), err=True)
+        return
+
+    if not os.path.exists(baseline):
+        click.echo("No baseline at {} to compare against.".format(baseline), err=True)
+        return
+
+    with open(baseline, "r") as file:
+        baseline_results = json.load(file)
+
+    regressions = 0
+    for measure, unit in [("seconds", "s"), ("bytes", "B")]:
+        # Anything new since the baseline was saved can't be checked, so say so
+        # rather than leaving it out quietly.
+        for name in sorted(results[measure]):
+            if name not in baseline_results.get(measure, {}):
+                click.echo(
+                    "{:<32} not in the baseline (run with --save-baseline)".format(
+                        name),
+                    err=True)
+
+        for name, base, value, ratio, regressed in compare(
+                results, baseline_results, tolerance, measure):
+            regressions += regressed
+            click.echo(
+                "{:<32} {:>12.3g}{} {:>12.3g}{} {:>7.2f}x{}".format(
+                    name,
+                    base,
+                    unit,
+                    value,
+                    unit,
+                    ratio,
+                    "  REGRESSION" if regressed else ""),
+                err=True)
+
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    bench()
@@ -0,0 +1,247 @@
+import analysis
+import collections
+import magic_items
+import math
+import os
+import spells
+
+# Bins expected to get fewer draws than this are merged together, since the tests
+# aren't trustworthy with tiny expected counts.
+MIN_EXPECTED = 5
+
+# How many draws each check makes by default.
+DEFAULT_SAMPLES = 200000
+
+# The chance of a check failing even though the generator is fine. Dozens of
+# tables are checked at once, so this is small enough that a clean run passes
+# them all.
+DEFAULT_ALPHA = 0.0001
+
+# Conformance checks compare how often each outcome was generated with how often
+# its weight says it should be. They use the batch path (Table.sample and the
+# *_records methods), which is what generates names in bulk, and only need a
+# count of each outcome, so even millions of draws take seconds.
+
+CheckResult = collections.namedtuple(
+    "CheckResult",
+    ["name", "samples", "bins", "dof", "statistic", "p_value", "passed"])
+
+
+def chi_square_statistic(observed, expected):
+    """
+    Returns Pearson's chi-square statistic for lists of observed and expected
+    counts.
+    """
+    return sum(
+        (seen - wanted) ** 2 / wanted for seen, wanted in zip(observed, expected))
+
+
+def g_statistic(observed, expected):
+    """
+    Returns the G-test (log-likelihood ratio) statistic for lists of observed and
+    expected counts.
+    """
+    return 2 * sum(
+        seen * math.log(seen / wanted)
+        for seen, wanted in zip(observed, expected) if seen)
+
+
+def chi_square_p_value(statistic, dof):
+    """
+    Returns the chance of a chi-square distributed value with dof degrees of freedom
+    being at least statistic.
+    """
+    if dof <= 0:
+        return 1.0
+
+    return regularized_gamma_q(dof / 2, statistic / 2)
+
+
+def regularized_gamma_q(a, x, tolerance=1e-15, max_terms=1000):
+    """
+    Returns the regularized upper incomplete gamma function Q(a, x).
+    """
+    if x <= 0:
+        return 1.0
+
+    log_prefix = a * math.log(x) - x - math.lgamma(a)
+
+    # Below a + 1 the series for P(a, x) converges quickly, and Q is 1 - P.
+    if x < a + 1:
+        term = total = 1 / a
+        for n in range(1, max_terms):
+            term *= x / (a + n)
+            total += term
+            if abs(term) < abs(total) * tolerance:
+                break
+        return max(0.0, 1 - total * math.exp(log_prefix))
+
+    # Above it, the continued fraction for Q converges quickly (evaluated with
+    # Lentz's method).
+    tiny = 1e-300
+    b = x + 1 - a
+    c = 1 / tiny
+    d = 1 / b
+    fraction = d
+    for n in range(1, max_terms):
+        an = -n * (n - a)
+        b += 2
+        d = an * d + b
+        d = tiny if abs(d) < tiny else d
+        c = b + an / c
+        c = tiny if abs(c) < tiny else c
+        d = 1 / d
+        delta = d * c
+        fraction *= delta
+        if abs(delta - 1) < tolerance:
+            break
+
+    return math.exp(log_prefix) * fraction
+
+
+def merge_small_bins(observed, expected, min_expected=MIN_EXPECTED):
+    """
+    Returns lists of observed and expected counts with every bin expected to get
+    fewer than min_expected draws merged into one.
+    """
+    kept_observed, kept_expected = [], []
+    small_observed = small_expected = 0
+    for seen, wanted in zip(observed, expected):
+        if wanted < min_expected:
+            small_observed += seen
+            small_expected += wanted
+        else:
+            kept_observed.append(seen)
+            kept_expected.append(wanted)
+
+    if small_expected:
+        # A merged bin that's still too small goes in with the smallest other bin.
+        if small_expected < min_expected and kept_expected:
+            smallest = kept_expected.index(min(kept_expected))
+            kept_observed[smallest] += small_observed
+            kept_expected[smallest] += small_expected
+        else:
+            kept_observed.append(small_observed)
+            kept_expected.append(small_expected)
+
+    return kept_observed, kept_expected
+
+
+def check_counts(name, counts, distribution, test="chi2", alpha=DEFAULT_ALPHA):
+    """
+    Tests whether counts (a mapping of outcomes to how often they were generated)
+    fits distribution (a mapping of outcomes to their probabilities), returning a
+    CheckResult.
+    """
+    samples = sum(counts.values())
+    outcomes = list(distribution)
+
+    observed = [counts.get(outcome, 0) for outcome in outcomes]
+    expected = [float(distribution[outcome]) * samples for outcome in outcomes]
+    # Anything generated that shouldn't be possible at all is a failure in itself.
+    impossible = samples - sum(observed)
+
+    observed, expected = merge_small_bins(observed, expected)
+    dof = len(observed) - 1
+
+    if test == "g":
+        statistic = g_statistic(observed, expected)
+    else:
+        statistic = chi_square_statistic(observed, expected)
+
+    p_value = 0.0 if impossible else chi_square_p_value(statistic, dof)
+
+    return CheckResult(
+        name, samples, len(observed), dof, statistic, p_value, p_value >= alpha)
+
+
+def check_table(name, table, samples, rng=None, test="chi2", alpha=DEFAULT_ALPHA):
+    """
+    Draws samples entries from table in one batch and tests them against the
+    table's weights.
+    """
+    counts = collections.Counter(table.sample(samples, rng))
+
+    return check_counts(name, counts, analysis.table_distribution(table), test, alpha)
+
+
+def table_checks(item_gen, samples, rng=None, test="chi2", alpha=DEFAULT_ALPHA):
+    """
+    Checks every table in Spells.json, MagicItems.json and Items.json, plus the
+    item type and template tables.
+    """
+    # Each pack's own tables, so the tables one pack shares from another (like the
+    # wizard name tables) are only checked once, under the file they come from.
+    packs = [item_gen.spell_gen.pack, item_gen.pack, item_gen.item_pack]
+    named_tables = [("M_Item", item_gen.item_types)]
+    for pack in packs:
+        filename = os.path.basename(pack.json_filename)
+        named_tables.extend(
+            ("{}:{}".format(filename, field.name), table)
+            for field, table in pack.own_tables().items())
+    named_tables.append(("spell templates", spells.SPELL_NAME_TEMPLATE_TABLE))
+    named_tables.append(("item templates", magic_items.M_ITEM_TEMPLATE_TABLE))
+
+    return [
+        check_table(name, table, samples, rng, test, alpha)
+        for name, table in named_tables
+    ]
+
+
+def record_checks(item_gen, samples, test="chi2", alpha=DEFAULT_ALPHA):
+    """
+    Generates samples spells and samples magic items as records, and checks how
+    often each item type and template came up.
+    """
+    template_chances = analysis.table_distribution(spells.SPELL_NAME_TEMPLATE_TABLE)
+    spell_template_chances = {
+        spells.SPELL_NAME_TEMPLATE_INDEX[template]: chance
+        for template, chance in template_chances.items()
+    }
+    template_chances = analysis.table_distribution(magic_items.M_ITEM_TEMPLATE_TABLE)
+    item_template_chances = {
+        magic_items.M_ITEM_TEMPLATE_INDEX[template]: chance
+        for template, chance in template_chances.items()
+    }
+    type_chances = {
+        item_type.name: chance
+        for item_type, chance in analysis.table_distribution(
+            item_gen.item_types).items()
+    }
+
+    spell_records = item_gen.spell_gen.spell_records(samples)
+    spell_templates = collections.Counter(record.template for record in spell_records)
+
+    item_records = item_gen.magic_item_records(samples)
+    item_types = collections.Counter(record.kind for record in item_records)
+    # Scrolls' templates are spell templates, so they're left out here.
+    item_templates = collections.Counter(
+        record.template for record in item_records if record.kind != "SCROLL")
+
+    return [
+        check_counts(
+            "spell_records templates",
+            spell_templates,
+            spell_template_chances,
+            test,
+            alpha),
+        check_counts(
+            "magic_item_records types", item_types, type_chances, test, alpha),
+        check_counts(
+            "magic_item_records templates",
+            item_templates,
+            item_template_chances,
+            test,
+            alpha),
+    ]
+
+
+def run_checks(samples=DEFAULT_SAMPLES, rng=None, test="chi2", alpha=DEFAULT_ALPHA):
+    """
+    Runs every conformance check, returning a list of CheckResults.
+    """
+    item_gen = magic_items.M_Item_Generator(rng)
+
+    return (
+        table_checks(item_gen, samples, rng, test, alpha)
+        + record_checks(item_gen, samples, test, alpha))
@@ -1,17 +1,356 @@
-import tools
+import collections
+import functools
+import importlib
+import packs
+import sys
+import tables
+import threading
+import weakref
 
+# How many names to generate per batch when streaming large numbers of them.
+CHUNK_SIZE = 10000
 
-class PerilGenerator:
-    def __init__(self, table_file, table_fields):
-        # First we'll try to load the tables from the specified JSON file.
+# The async methods generate batches of up to this many names right on the event
+# loop, since handing them to an executor would cost more than generating them.
+# Bigger batches go to an executor, so the loop isn't held up.
+ASYNC_INLINE_SIZE = 1000
+
+# A generated name along with what kind of thing it names (such as "SPELL" or the
+# name of an M_Item) and the index of the template it was made from.
+GeneratedName = collections.namedtuple("GeneratedName", ["name", "kind", "template"])
+
+# A GeneratedName along with the entry drawn for each field of its template: a
+# dictionary mapping the fields (members of the generator's enum of table names) to
+# entries, with the wizard name prefix and suffix as separate entries.
+ComponentRecord = collections.namedtuple(
+    "ComponentRecord", ["name", "kind", "template", "components"])
+
+
+def chunked(generate, total, chunk_size=CHUNK_SIZE):
+    """
+    Yields total results from generate, a function that takes a count and returns a
+    list of that many results, calling it in chunks of at most chunk_size so only
+    one chunk is ever held in memory.
+    """
+    remaining = total
+    while remaining > 0:
+        count = min(chunk_size, remaining)
+        yield from generate(count)
+        remaining -= count
+
+
+async def achunked(
+        generate,
+        total,
+        chunk_size=CHUNK_SIZE,
+        executor=None,
+        inline_size=ASYNC_INLINE_SIZE):
+    """
+    Works like chunked(), but as an async iterator yielding each chunk as a list.
+
+    Chunks of more than inline_size results are generated in executor (the event
+    loop's default executor if it's None), so other tasks keep running meanwhile.
+    """
+    # asyncio is slow to import and only needed by asyncio applications, which
+    # have already imported it, so the command line doesn't pay for it.
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    remaining = total
+    while remaining > 0:
+        count = min(chunk_size, remaining)
+        if count <= inline_size:
+            chunk = generate(count)
+        else:
+            chunk = await loop.run_in_executor(executor, generate, count)
+        yield chunk
+        remaining -= count
+
+
+# Every registered kind of generator, mapping its name (like "spell") to either the
+# generator class or a "module:class" string naming it, imported when first used.
+_generator_types = {
+    "item": "magic_items:M_Item_Generator",
+    "spell": "spells:Spell_Generator",
+}
+_generator_types_lock = threading.Lock()
+
+
+def register_generator(kind, factory, replace=False):
+    """
+    Registers a kind of generator under a name, so the command line tool, the
+    server and the process pool can create it by name. factory is a function (or
+    class) taking a random number generator, or a "module:class" string.
+    """
+    with _generator_types_lock:
+        if kind in _generator_types and not replace:
+            raise ValueError("There's already a generator named {}!".format(kind))
+        _generator_types[kind] = factory
+
+
+def generator_kinds():
+    """
+    Returns the names of every registered kind of generator.
+    """
+    with _generator_types_lock:
+        return list(_generator_types)
+
+
+def generator_module(kind):
+    """
+    Returns the name of the module a registered kind of generator is imported from
+    when it's first created, or None if there's nothing left to import.
+    """
+    with _generator_types_lock:
         try:
-            self.tables = tools.load_tables(table_file, table_fields)
-        # If the JSON file doesn't exist, we'll try to build the tables from
-        # a text file of the same name and save them to a JSON file for later
-        # use.
-        except FileNotFoundError:
-            tools.build_tables(table_file, table_fields)
-            self.tables = tools.load_tables(table_file, table_fields)
+            factory = _generator_types[kind]
+        except KeyError:
+            raise KeyError("No generator named {}!".format(kind))
+
+    if isinstance(factory, str):
+        return factory.partition(":")[0]
+
+    return None
+
+
+def create_generator(kind, rng=None):
+    """
+    Returns a new generator of a registered kind.
+    """
+    with _generator_types_lock:
+        try:
+            factory = _generator_types[kind]
+        except KeyError:
+            raise KeyError("No generator named {}!".format(kind))
+
+    # The import happens outside the lock, in case the module registers generators
+    # of its own.
+    if isinstance(factory, str):
+        module_name, _, class_name = factory.partition(":")
+        factory = getattr(importlib.import_module(module_name), class_name)
+
+    return factory(rng)
+
+
+# A wizard name pool holds every prefix and suffix pair, unless there are more
+# pairs than this, in which case names are joined as they're drawn and the most
+# recently drawn ones are kept in a cache of this size.
+WIZARD_POOL_MAX_SIZE = 1 << 20
+WIZARD_NAME_CACHE_SIZE = 1 << 16
+
+# The wizard name pool for each pair of prefix and suffix tables (by their ids),
+# shared by every generator drawing from those tables. Generators hold on to their
+# pools, and a pool is dropped from here once none of them do (say, after they've
+# all reloaded their tables). A pool holds on to its tables, so their ids can't be
+# reused while it's here.
+_wizard_pools = weakref.WeakValueDictionary()
+_wizard_pools_lock = threading.Lock()
+
+
+class WizardNamePool:
+    """
+    Every wizard name a prefix table and a suffix table can make, already joined,
+    so drawing a wizard name is a single draw with no string building.
+
+    Each prefix and suffix pair becomes one entry, weighted by the product of their
+    weights, so names come up exactly as often as drawing the prefix and suffix
+    separately. If there are too many pairs, names are joined as they're drawn
+    instead, with a bounded cache of the joined names.
+    """
+
+    def __init__(
+            self,
+            prefixes,
+            suffixes,
+            max_size=WIZARD_POOL_MAX_SIZE,
+            cache_size=WIZARD_NAME_CACHE_SIZE):
+        self.prefixes = prefixes
+        self.suffixes = suffixes
+
+        if len(prefixes.entries) * len(suffixes.entries) > max_size:
+            self.table = None
+            self.join = functools.lru_cache(maxsize=cache_size)(join_wizard_name)
+            return
+
+        names = []
+        weights = []
+        for prefix, prefix_weight in zip(prefixes.entries, prefixes.weights):
+            prefix = prefix.strip("-")
+            for suffix, suffix_weight in zip(suffixes.entries, suffixes.weights):
+                names.append(sys.intern(prefix + suffix.strip("-")))
+                weights.append(prefix_weight * suffix_weight)
+
+        self.table = tables.Table(names, weights).freeze()
+
+    def random(self, rng=None):
+        """
+        Returns a random wizard name.
+        """
+        if self.table is not None:
+            return self.table.random(rng)
+
+        return self.join(self.prefixes.random(rng), self.suffixes.random(rng))
+
+    def sample(self, k, rng=None):
+        """
+        Returns a list of k random wizard names.
+        """
+        if self.table is not None:
+            return self.table.sample(k, rng)
+
+        join = self.join
+        return [
+            join(prefix, suffix)
+            for prefix, suffix in zip(
+                self.prefixes.sample(k, rng), self.suffixes.sample(k, rng))
+        ]
+
+
+def join_wizard_name(prefix, suffix):
+    """
+    Joins a wizard name prefix and suffix, dropping the hyphens that mark where
+    they meet.
+    """
+    return sys.intern(prefix.strip("-") + suffix.strip("-"))
+
+
+def wizard_name_pool(prefixes, suffixes):
+    """
+    Returns the shared WizardNamePool for a prefix table and a suffix table,
+    building it the first time it's asked for.
+    """
+    key = (id(prefixes), id(suffixes))
+    with _wizard_pools_lock:
+        pool = _wizard_pools.get(key)
+        if pool is None:
+            pool = _wizard_pools[key] = WizardNamePool(prefixes, suffixes)
+
+    return pool
+
+
+class PerilGenerator:
+    def __init__(self, pack, rng=None, wizard_pool=False):
+        # Every random draw goes through this generator's own random number
+        # generator (anything with a random() method, like random.Random), or the
+        # random module's shared one if it's None.
+        self.rng = rng
+        # The table pack (or the name of a registered one) this generator's tables
+        # come from.
+        self.pack = packs.get_pack(pack) if isinstance(pack, str) else pack
+        self.table_file = self.pack.json_filename
+        self.table_fields = self.pack.fields
+        # Whether wizard names are drawn from a WizardNamePool of every prefix and
+        # suffix pair (built the first time a wizard name is needed), instead of
+        # drawing and joining a prefix and suffix each time.
+        self.wizard_pool = wizard_pool
+        # The WizardNamePool for each enum of table names, looked up when first
+        # needed.
+        self._wizard_name_pools = {}
+        # The tables aren't loaded until something first needs them.
+        self._tables = None
+
+    @property
+    def tables(self):
+        """
+        This generator's tables, loaded the first time they're needed.
+        """
+        if self._tables is None:
+            self._tables = self.load_tables()
+
+        return self._tables
+
+    def load_tables(self):
+        """
+        Returns the shared tables for this generator's table pack.
+        """
+        # The tables come from the shared registry, so they're only read from disk
+        # once no matter how many generators use them. They're compiled from the
+        # pack's text files whenever those change, falling back on the JSON file if
+        # there are no text files to compile.
+        return self.pack.tables()
+
+    def load(self):
+        """
+        Loads every table this generator needs, if they aren't loaded already.
+        """
+        if self._tables is None:
+            self._tables = self.load_tables()
+
+    def is_loaded(self):
+        """
+        Returns true if every table this generator needs is loaded.
+        """
+        return self._tables is not None
+
+    async def aload(self, executor=None):
+        """
+        Loads every table this generator needs in executor (the event loop's default
+        executor if it's None), so reading them from disk doesn't block the loop.
+        """
+        import asyncio
+
+        if not self.is_loaded():
+            await asyncio.get_running_loop().run_in_executor(executor, self.load)
+
+    async def agenerate(self, generate, total, chunk_size=CHUNK_SIZE, executor=None):
+        """
+        Yields total results from generate (a function that takes a count and
+        returns a list of that many results) in lists of at most chunk_size, as an
+        async iterator. The tables are loaded first without blocking the event loop,
+        and big chunks are generated in executor (see achunked()).
+
+        Chunks are generated one at a time, so nothing else should use this
+        generator from another thread until the iteration is done.
+        """
+        await self.aload(executor)
+        async for chunk in achunked(generate, total, chunk_size, executor):
+            yield chunk
+
+    def arecords(self, count, subtype=None, chunk_size=CHUNK_SIZE, executor=None):
+        """
+        The async counterpart of records(): an async iterator yielding count
+        GeneratedName records in lists of at most chunk_size.
+        """
+        return self.agenerate(
+            functools.partial(self.records, subtype=subtype),
+            count,
+            chunk_size,
+            executor)
+
+    def reload(self):
+        """
+        Re-reads this generator's tables from disk, picking up any changes.
+        """
+        self.pack.reload()
+        self._tables = None
+        self._wizard_name_pools = {}
+        self.clear_compiled_templates()
+
+    def clear_compiled_templates(self):
+        """
+        Throws away any templates compiled against this generator's tables, so
+        they're compiled afresh the next time they're needed.
+
+        Compiled templates hold on to the table draw methods they were compiled
+        with, so this is also how a generator picks up patched draw methods (see
+        instrument.py).
+        """
+
+    def records(self, count, subtype=None):
+        """
+        Generates a list of count GeneratedName records in one batch, optionally of
+        a named subtype (like an item type). Every registered generator type has
+        this, so code that only knows a generator's kind can still drive it.
+        """
+        raise NotImplementedError
+
+    def component_records(self, count, subtype=None, constraints=None):
+        """
+        Works like records(), but generates ComponentRecords, which also say which
+        entry was drawn for each field. constraints optionally narrows down the
+        entries drawn for some fields (see constrain()).
+        """
+        raise NotImplementedError
 
     def is_wizard_name(self, table, table_names):
         """
@@ -25,9 +364,12 @@ class PerilGenerator:
         """
         Generates a random wizard name.
         """
+        if self.wizard_pool:
+            return self.wizard_name_pool(table_names).random(self.rng)
+
         # Get a random prefix and a random suffix.
-        prefix = self.tables[table_names.WIZARD_NAME_PRE].random()
-        suffix = self.tables[table_names.WIZARD_NAME_POST].random()
+        prefix = self.tables[table_names.WIZARD_NAME_PRE].random(self.rng)
+        suffix = self.tables[table_names.WIZARD_NAME_POST].random(self.rng)
 
         # Join the prefix and suffix together after removing the hyphens.
         prefix = prefix.strip("-")
@@ -36,3 +378,263 @@ class PerilGenerator:
         wizard = "".join([prefix, suffix])
 
         return wizard
+
+    def wizard_name_pool(self, table_names):
+        """
+        Returns the WizardNamePool for this generator's wizard name tables.
+        """
+        pool = self._wizard_name_pools.get(table_names)
+        if pool is None:
+            pool = self._wizard_name_pools[table_names] = wizard_name_pool(
+                self.tables[table_names.WIZARD_NAME_PRE],
+                self.tables[table_names.WIZARD_NAME_POST])
+
+        return pool
+
+    def wizard_name_draw(self, table_names):
+        """
+        Returns a function that takes a random number generator and returns a random
+        wizard name, with the prefix and suffix tables already looked up.
+        """
+        if self.wizard_pool:
+            return self.wizard_name_pool(table_names).random
+
+        prefixes = self.tables[table_names.WIZARD_NAME_PRE]
+        suffixes = self.tables[table_names.WIZARD_NAME_POST]
+
+        def draw(rng):
+            return prefixes.random(rng).strip("-") + suffixes.random(rng).strip("-")
+
+        return draw
+
+    def compile_template(self, template, table_names, special_tables=None):
+        """
+        Compiles a name template into a function that takes a random number generator
+        and returns a filled-in name.
+
+        All of the work of deciding where each field comes from is done here, once:
+        the wizard name prefix and suffix become a single slot, and every other field
+        is bound to its table. special_tables optionally maps fields to tables that
+        don't come from self.tables.
+        """
+        special_tables = {} if special_tables is None else special_tables
+
+        draws = []
+        wizard_name = False
+        for table in template.fields:
+            if self.is_wizard_name(table, table_names):
+                if not wizard_name:
+                    draws.append(self.wizard_name_draw(table_names))
+                    wizard_name = True
+
+            elif table in special_tables:
+                draws.append(special_tables[table].random)
+
+            else:
+                draws.append(self.tables[table].random)
+
+        return template.compile(draws)
+
+    def compile_template_table(self, template_table, table_names, special_tables=None):
+        """
+        Returns a table of compiled templates with the same weights as template_table,
+        so choosing a template and filling it in is one draw and one call.
+        """
+        compiled = [
+            self.compile_template(template, table_names, special_tables)
+            for template in template_table.entries
+        ]
+
+        return tables.Table(compiled, list(template_table.weights)).freeze()
+
+    def generate_wizard_names(self, table_names, k):
+        """
+        Generates a list of k random wizard names in one batch.
+        """
+        if self.wizard_pool:
+            return self.wizard_name_pool(table_names).sample(k, self.rng)
+
+        prefixes = self.tables[table_names.WIZARD_NAME_PRE].sample(k, self.rng)
+        suffixes = self.tables[table_names.WIZARD_NAME_POST].sample(k, self.rng)
+
+        return [
+            "".join([prefix.strip("-"), suffix.strip("-")])
+            for prefix, suffix in zip(prefixes, suffixes)
+        ]
+
+    def fill_templates(self, template_table, table_names, n, special_fields=None):
+        """
+        Generates n names from templates chosen randomly from template_table.
+
+        Rather than filling one name at a time, the names are grouped by template
+        and each field is filled for the whole group with a single batch draw.
+        special_fields optionally maps a field to a function taking a count and a
+        random number generator and returning that many entries, for fields that
+        don't come from self.tables.
+        """
+        return self.fill_templates_with_choices(
+            template_table, table_names, n, special_fields)[0]
+
+    def constrain(self, template_table, table_names, constraints, field_tables=None):
+        """
+        Narrows down template_table and the tables its fields are drawn from, so
+        that only names whose fields take the given entries are generated.
+
+        constraints maps fields (members of table_names, or their names, like
+        "ADJECTIVE", ignoring case) to an entry or a collection of entries, matched
+        ignoring case.
+        field_tables optionally maps fields to tables to use instead of self.tables.
+
+        Only templates with every constrained field can make a matching name, so
+        the rest are dropped, and each constrained field draws from a table of just
+        its matching entries, keeping their weights. Drawing from these gives
+        exactly the names that drawing from the full tables and throwing away the
+        ones that don't match would, in the same proportions.
+
+        Returns the narrowed template table, the narrowed field tables, and the
+        chance that a name drawn from the full tables would have matched. Raises
+        ValueError if no name can match, including if a field isn't one of
+        table_names.
+        """
+        field_tables = {} if field_tables is None else dict(field_tables)
+        if not constraints:
+            return template_table, field_tables, 1.0
+
+        fields = {}
+        unknown = []
+        for field, allowed in constraints.items():
+            if isinstance(field, str):
+                field = table_names.__members__.get(field.upper(), field)
+            if isinstance(field, table_names):
+                fields[field] = allowed
+            else:
+                unknown.append(getattr(field, "name", field))
+
+        if unknown:
+            raise ValueError("No template has a field named {}!".format(
+                " or ".join(unknown)))
+        constraints = fields
+
+        templates = []
+        weights = []
+        for template, weight in zip(template_table.entries, template_table.weights):
+            if all(field in template.fields for field in constraints):
+                templates.append(template)
+                weights.append(weight)
+
+        if not templates:
+            raise ValueError("No template has every one of the fields {}!".format(
+                ", ".join(field.name for field in constraints)))
+
+        chance = sum(weights) / sum(template_table.weights)
+
+        for field, allowed in constraints.items():
+            wanted = [allowed] if isinstance(allowed, str) else list(allowed)
+            allowed = {entry.casefold() for entry in wanted}
+
+            table = field_tables[field] if field in field_tables else self.tables[field]
+            entries = []
+            entry_weights = []
+            for entry, weight in zip(table.entries, table.weights):
+                if entry.casefold() in allowed:
+                    entries.append(entry)
+                    entry_weights.append(weight)
+
+            if not entries:
+                raise ValueError("No {} entry is {}!".format(
+                    field.name, " or ".join(wanted)))
+
+            chance *= sum(entry_weights) / sum(table.weights)
+            field_tables[field] = tables.Table(entries, entry_weights).freeze()
+
+        return tables.Table(templates, weights).freeze(), field_tables, chance
+
+    def fill_templates_with_components(
+            self, template_table, table_names, n, field_tables=None):
+        """
+        Works like fill_templates_with_choices, but also returns, for each name, a
+        dictionary mapping each field of its template to the entry drawn for it.
+
+        Unlike the other ways of filling templates, the wizard name prefix and
+        suffix are drawn (and recorded) separately. field_tables optionally maps
+        fields to tables to draw from instead of self.tables, such as an item
+        type's table or the narrowed tables from constrain().
+        """
+        field_tables = {} if field_tables is None else field_tables
+
+        chosen = template_table.sample(n, self.rng)
+        groups = {}
+        for position, template in enumerate(chosen):
+            groups.setdefault(template, []).append(position)
+
+        names = [None] * n
+        components = [None] * n
+        for template, positions in groups.items():
+            count = len(positions)
+            fields = template.fields
+            columns = [
+                (field_tables[field] if field in field_tables else self.tables[field])
+                .sample(count, self.rng)
+                for field in fields
+            ]
+
+            # Each slot in the string is filled from one field, except the wizard
+            # name, whose slot is filled from the prefix and suffix joined.
+            slots = []
+            for index, field in enumerate(fields):
+                if field == table_names.WIZARD_NAME_PRE:
+                    slots.append((index, fields.index(table_names.WIZARD_NAME_POST)))
+                elif field != table_names.WIZARD_NAME_POST:
+                    slots.append(index)
+
+            fill = template.string.format
+            for position, entries in zip(positions, zip(*columns)):
+                names[position] = fill(*[
+                    entries[slot] if type(slot) is int
+                    else entries[slot[0]].strip("-") + entries[slot[1]].strip("-")
+                    for slot in slots
+                ])
+                components[position] = dict(zip(fields, entries))
+
+        return names, chosen, components
+
+    def fill_templates_with_choices(
+            self, template_table, table_names, n, special_fields=None):
+        """
+        Works like fill_templates, but returns both the list of names and the list
+        of templates they were made from.
+        """
+        special_fields = {} if special_fields is None else special_fields
+
+        # Remember where each name belongs, so the results come back in the same
+        # order the templates were drawn in.
+        chosen = template_table.sample(n, self.rng)
+        groups = {}
+        for position, template in enumerate(chosen):
+            groups.setdefault(template, []).append(position)
+
+        names = [None] * n
+        for template, positions in groups.items():
+            count = len(positions)
+            columns = []
+            wizard_names = None
+
+            for table in template.fields:
+                # As with a single name, the wizard prefix and suffix tables share
+                # one slot, so we only fill it once.
+                if self.is_wizard_name(table, table_names):
+                    if wizard_names is None:
+                        wizard_names = self.generate_wizard_names(table_names, count)
+                        columns.append(wizard_names)
+
+                elif table in special_fields:
+                    columns.append(special_fields[table](count, self.rng))
+
+                else:
+                    columns.append(self.tables[table].sample(count, self.rng))
+
+            name_string = template.string
+            for position, info in zip(positions, zip(*columns)):
+                names[position] = name_string.format(*info)
+
+        return names, chosen
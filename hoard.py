@@ -0,0 +1,138 @@
+from item_types import M_Item, M_Item_Weights
+import collections
+import generator as gen
+import tables
+
+# How many items each hoard gets when nothing says otherwise.
+DEFAULT_HOARD_SIZE = 10
+
+# A generated hoard: its position in the run (counting from 0) and a list of
+# GeneratedName records for the magic items in it.
+Hoard = collections.namedtuple("Hoard", ["index", "items"])
+
+# Rather than generating each hoard's items one at a time, a batch of hoards is
+# planned up front (every item type in every hoard is decided first), then all the
+# items of each type across the whole batch are generated with one call to
+# specific_item_records(). That call fills the items in bulk, grouped by template,
+# and draws the spells for every scroll in the batch in one go through the spell
+# tables. Each hoard then takes its items back in order.
+
+
+class HoardSpec:
+    """
+    What goes in each hoard: a fixed count of items of some item types, plus
+    random_items more whose item types are drawn by weight.
+
+    counts maps M_Items to how many of each every hoard gets. weights maps M_Items
+    to their weights for the random items, defaulting to the usual item type
+    weights.
+    """
+
+    def __init__(self, counts=None, random_items=0, weights=None):
+        self.counts = {} if counts is None else dict(counts)
+        self.random_items = random_items
+
+        if weights is None:
+            weights = dict(zip(M_Item, M_Item_Weights))
+        self.weights = dict(weights)
+
+        if any(count < 0 for count in self.counts.values()) or random_items < 0:
+            raise ValueError("A hoard can't have a negative number of items!")
+        if any(weight < 0 for weight in self.weights.values()):
+            raise ValueError("Item type weights can't be negative!")
+        if random_items and not any(self.weights.values()):
+            raise ValueError("Random items need at least one item type with weight!")
+
+        self.item_types = tables.Table(
+            list(self.weights), list(self.weights.values())).freeze()
+
+    def size(self):
+        """
+        Returns how many items each hoard holds.
+        """
+        return sum(self.counts.values()) + self.random_items
+
+    def plan(self, num_hoards, rng=None):
+        """
+        Returns a list of num_hoards lists, giving the item type of each item in
+        each hoard: the fixed items first, then the random ones.
+        """
+        fixed = [
+            item_type
+            for item_type, count in self.counts.items()
+            for _ in range(count)
+        ]
+
+        per_hoard = self.random_items
+        if not per_hoard:
+            return [list(fixed) for _ in range(num_hoards)]
+
+        drawn = self.item_types.sample(num_hoards * per_hoard, rng)
+        return [
+            fixed + drawn[start:start + per_hoard]
+            for start in range(0, num_hoards * per_hoard, per_hoard)
+        ]
+
+
+def parse_item_counts(pairs, what="count"):
+    """
+    Returns a dictionary mapping M_Items to numbers, from strings like "WAND=2".
+    what names the numbers in error messages.
+    """
+    numbers = {}
+    for pair in pairs:
+        name, equals, number = pair.partition("=")
+        try:
+            item_type = M_Item[name.strip().upper()]
+        except KeyError:
+            raise ValueError("Unknown item type {}!".format(name.strip()))
+
+        try:
+            value = int(number) if equals else None
+        except ValueError:
+            value = None
+        if value is None or value < 0:
+            raise ValueError(
+                "Expected TYPE=N with a whole number {}, not {}!".format(what, pair))
+
+        numbers[item_type] = numbers.get(item_type, 0) + value
+
+    return numbers
+
+
+def hoard_batch(item_gen, spec, num_hoards, first_index=0):
+    """
+    Generates a list of num_hoards Hoards from spec with an M_Item_Generator,
+    numbering them from first_index.
+    """
+    plan = spec.plan(num_hoards, item_gen.rng)
+
+    totals = collections.Counter(
+        item_type for item_types in plan for item_type in item_types)
+    generated = {
+        item_type: iter(item_gen.specific_item_records(item_type, total))
+        for item_type, total in totals.items()
+    }
+
+    return [
+        Hoard(
+            first_index + offset,
+            [next(generated[item_type]) for item_type in item_types])
+        for offset, item_types in enumerate(plan)
+    ]
+
+
+def generate_hoards(item_gen, spec, num_hoards, chunk_size=gen.CHUNK_SIZE):
+    """
+    Yields num_hoards Hoards from spec, one at a time, with an M_Item_Generator.
+
+    The hoards are planned and generated in batches holding about chunk_size
+    items altogether, so only one batch is ever held in memory.
+    """
+    hoards_per_batch = max(1, chunk_size // max(1, spec.size()))
+
+    index = 0
+    while index < num_hoards:
+        count = min(hoards_per_batch, num_hoards - index)
+        yield from hoard_batch(item_gen, spec, count, index)
+        index += count
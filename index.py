@@ -0,0 +1,195 @@
+import array
+import bisect
+import collections
+import generator as gen
+
+# A NameIndex keeps every ComponentRecord it's given in a list, and finds them by
+# their position in it. For each kind, template, table entry and name it keeps a
+# posting list: an array of the positions of the records with it, in order. A query
+# starts from the shortest posting list it involves and looks each candidate up in
+# the others with a binary search, so it only ever looks at records that could
+# match, however big the index is.
+POSTING_TYPE = "I"
+
+
+class NameIndex:
+    """
+    An index of generated names (as ComponentRecords), for finding which template
+    and table entries produced a name, and which names used an entry.
+
+    Fields are indexed by name (like "ADJECTIVE"), so a spell's adjective and a
+    magic item's adjective are found together. Entries are matched ignoring case,
+    as they are for constrained generation (see PerilGenerator.constrain()).
+    """
+
+    def __init__(self, records=()):
+        self.records = []
+        self.by_name = collections.defaultdict(_posting_list)
+        self.by_kind = collections.defaultdict(_posting_list)
+        self.by_template = collections.defaultdict(_posting_list)
+        self.by_entry = collections.defaultdict(_posting_list)
+        # How each (field name, casefolded entry) key in by_entry was first spelled.
+        self.spellings = {}
+        self.extend(records)
+
+    def __len__(self):
+        return len(self.records)
+
+    def add(self, record):
+        """
+        Adds a ComponentRecord to the index.
+        """
+        self.extend((record,))
+
+    def extend(self, records):
+        """
+        Adds every ComponentRecord in records to the index.
+        """
+        by_name = self.by_name
+        by_kind = self.by_kind
+        by_template = self.by_template
+        by_entry = self.by_entry
+        spellings = self.spellings
+        append = self.records.append
+
+        position = len(self.records)
+        for record in records:
+            append(record)
+            name, kind, template, components = record
+            by_name[name].append(position)
+            by_kind[kind].append(position)
+            by_template[kind, template].append(position)
+            for field, entry in components.items():
+                key = (field.name, entry.casefold())
+                if key not in spellings:
+                    spellings[key] = entry
+                by_entry[key].append(position)
+            position += 1
+
+    def lookup(self, name):
+        """
+        Returns a list of every record of the given name, which say the kind of
+        thing it names, the template it was made from and the entry drawn for each
+        field. (The same name can come from more than one set of entries.)
+        """
+        return [self.records[position] for position in self.by_name.get(name, ())]
+
+    def names_with(self, field, entry):
+        """
+        Returns a list of every record whose field (like "ADJECTIVE") took the given
+        entry, ignoring case.
+        """
+        return self.query(**{field: entry})
+
+    def entry_counts(self, field):
+        """
+        Returns a Counter of how many records took each entry of field, with each
+        entry spelled as it first came up.
+        """
+        field = field.upper()
+        return collections.Counter({
+            self.spellings[key]: len(positions)
+            for key, positions in self.by_entry.items()
+            if key[0] == field
+        })
+
+    def query(self, kind=None, template=None, contains=None, **components):
+        """
+        Returns a list of the records matching every filter given:
+
+        - kind, the kind of thing named, like "WAND" or "SPELL"
+        - template, the template index (of any kind of thing, unless kind is
+          given too)
+        - contains, text the name includes, like "Fire"
+        - any field, by name, with the entry it took, like adjective="Burning" (both
+          ignoring case)
+
+        The records come back in the order they were added.
+        """
+        postings = []
+        if kind is not None:
+            postings.append(self.by_kind.get(kind, ()))
+            if template is not None:
+                postings.append(self.by_template.get((kind, template), ()))
+        for field, entry in components.items():
+            postings.append(
+                self.by_entry.get((field.upper(), entry.casefold()), ()))
+
+        # Without a kind, the template index could be any kind's. Alongside other
+        # filters it's quickest to check it on the records they leave, but on its
+        # own the records with it are gathered up into one posting list.
+        check_template = template is not None and kind is None
+        if check_template and not postings:
+            merged = set()
+            for (_, template_index), positions in self.by_template.items():
+                if template_index == template:
+                    merged.update(positions)
+            postings.append(sorted(merged))
+            check_template = False
+
+        if postings:
+            postings.sort(key=len)
+            candidates = postings[0]
+            for others in postings[1:]:
+                candidates = _intersect(candidates, others)
+                if not candidates:
+                    break
+        else:
+            candidates = range(len(self.records))
+
+        records = self.records
+        if contains is None and not check_template:
+            return [records[position] for position in candidates]
+
+        matches = []
+        for position in candidates:
+            record = records[position]
+            if check_template and record.template != template:
+                continue
+            if contains is not None and contains not in record.name:
+                continue
+            matches.append(record)
+
+        return matches
+
+
+def _posting_list():
+    return array.array(POSTING_TYPE)
+
+
+def _intersect(candidates, others):
+    """
+    Returns a list of the positions in candidates that are also in others, both
+    sorted posting lists, taking time in proportion to the length of candidates
+    (and only the logarithm of the length of others).
+    """
+    matches = []
+    low = 0
+    high = len(others)
+    bisect_left = bisect.bisect_left
+
+    # Both lists are in order, so each search can start where the last one ended.
+    for position in candidates:
+        low = bisect_left(others, position, low, high)
+        if low == high:
+            break
+        if others[low] == position:
+            matches.append(position)
+
+    return matches
+
+
+def index_generated(generator, count, subtype=None, constraints=None, index=None):
+    """
+    Generates count names with a generator (of any registered kind), in chunks,
+    and returns a NameIndex of them (or adds them to index, if it's given).
+
+    subtype and constraints work as they do for the generator's
+    component_records().
+    """
+    index = NameIndex() if index is None else index
+    index.extend(gen.chunked(
+        lambda chunk: generator.component_records(chunk, subtype, constraints),
+        count))
+
+    return index
@@ -0,0 +1,387 @@
+import enum
+import functools
+import generator as gen
+import json
+import magic_items
+import spells
+import tables
+import threading
+import time
+import tools
+
+# Instrumentation works by swapping the hot path methods for timed, counting
+# versions while it's enabled, and putting the originals back when it's disabled, so
+# it costs nothing at all when it's off.
+#
+# Compiled templates hold on to the table draw methods they were compiled with, so
+# enable() and disable() have generators recompile their templates. Only generators
+# passed to them (and ones created afterwards) see the change.
+#
+# Worker processes started by parallel.generate() while instrumentation is on
+# record their own metrics, and send them back with each chunk to be merged in.
+
+# The methods that get timed and counted, as (class, method name) pairs.
+INSTRUMENTED = [
+    (tables.Table, "random"),
+    (tables.Table, "sample"),
+    (gen.PerilGenerator, "generate_wizard_name"),
+    (gen.PerilGenerator, "wizard_name_draw"),
+    (gen.PerilGenerator, "generate_wizard_names"),
+    (gen.PerilGenerator, "fill_templates_with_choices"),
+    (gen.PerilGenerator, "fill_templates_with_components"),
+    (spells.Spell_Generator, "spell"),
+    (spells.Spell_Generator, "spell_records"),
+    (magic_items.M_Item_Generator, "_random_item"),
+    (magic_items.M_Item_Generator, "specific_item"),
+    (magic_items.M_Item_Generator, "magic_item_records"),
+    (magic_items.ItemTypeGenerator, "records"),
+]
+
+# The kind that item name templates are reported under, whatever the item type:
+# every type draws from the same templates, and batches can't tell them apart.
+# (Scrolls are made from spell name templates, so they're reported as "SPELL".)
+ITEM_TEMPLATE_KIND = "ITEM"
+
+# The prefix of every metric name in Prometheus output.
+PROMETHEUS_PREFIX = "perilous_gen"
+
+# The original methods, while instrumentation is enabled.
+_originals = {}
+
+
+class Metrics:
+    """
+    What's been recorded since instrumentation was enabled: how often each
+    instrumented method was called and how long it took altogether, how often each
+    table entry was drawn, and how often each template was chosen, along with
+    whatever worker processes sent back (see merge()).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Forgets everything recorded so far.
+        """
+        with self.lock:
+            self.calls = {}
+            self.seconds = {}
+            # Each table's draw counts, keyed by the table and then by entry.
+            self.draws = {}
+            # The tables whose entries are templates, and the kind of name each one
+            # makes, so their draws can be reported by template index.
+            self.template_tables = {
+                spells.SPELL_NAME_TEMPLATE_TABLE: "SPELL",
+                magic_items.M_ITEM_TEMPLATE_TABLE: ITEM_TEMPLATE_KIND,
+            }
+            # Snapshots from other processes, added together.
+            self.merged = {"calls": {}, "tables": {}, "templates": {}}
+
+    def record_call(self, name, seconds):
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+            self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+
+    def record_draws(self, table, entries):
+        with self.lock:
+            counts = self.draws.setdefault(table, {})
+            for entry in entries:
+                counts[entry] = counts.get(entry, 0) + 1
+
+    def name_template_table(self, table, kind):
+        """
+        Marks table as a table of templates (or compiled templates) for making names
+        of the given kind, so its draws are reported by template index.
+        """
+        with self.lock:
+            self.template_tables.setdefault(table, kind)
+
+    def merge(self, snapshot):
+        """
+        Adds a snapshot() taken in another process (like a worker process) to what's
+        been recorded here.
+        """
+        with self.lock:
+            _add_snapshot(self.merged, snapshot)
+
+    def snapshot(self):
+        """
+        Returns everything recorded so far as a dictionary of plain values, with
+        "calls" (count and seconds for each method), "tables" (draws of each entry
+        of each table) and "templates" (choices of each template index for each
+        kind of name).
+        """
+        table_names = tools.shared_table_names()
+
+        with self.lock:
+            calls = {
+                name: {"count": count, "seconds": self.seconds[name]}
+                for name, count in self.calls.items()
+            }
+
+            table_draws = {}
+            template_draws = {}
+            for table, counts in self.draws.items():
+                if table in self.template_tables:
+                    # Templates are reported by where they sit in their table.
+                    positions = {
+                        entry: index for index, entry in enumerate(table.entries)}
+                    kind_draws = template_draws.setdefault(
+                        self.template_tables[table], {})
+                    for entry, count in counts.items():
+                        index = positions[entry]
+                        kind_draws[index] = kind_draws.get(index, 0) + count
+                    continue
+
+                name = table_names.get(table) or table_name(table)
+                name_draws = table_draws.setdefault(name, {})
+                for entry, count in counts.items():
+                    label = entry_label(entry)
+                    name_draws[label] = name_draws.get(label, 0) + count
+
+            snapshot = {
+                "calls": calls, "tables": table_draws, "templates": template_draws}
+            _add_snapshot(snapshot, self.merged)
+
+        return snapshot
+
+    def to_json(self):
+        """
+        Returns everything recorded so far as a JSON document.
+        """
+        return json.dumps(self.snapshot(), indent=2, sort_keys=True)
+
+    def to_prometheus(self):
+        """
+        Returns everything recorded so far in the Prometheus text exposition format.
+        """
+        snapshot = self.snapshot()
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            full_name = "{}_{}".format(PROMETHEUS_PREFIX, name)
+            lines.append("# HELP {} {}".format(full_name, help_text))
+            lines.append("# TYPE {} {}".format(full_name, kind))
+            for labels, value in samples:
+                label_text = ",".join(
+                    '{}="{}"'.format(label, prometheus_escape(label_value))
+                    for label, label_value in labels.items())
+                lines.append("{}{{{}}} {}".format(full_name, label_text, value))
+
+        calls = sorted(snapshot["calls"].items())
+        metric(
+            "calls_total",
+            "counter",
+            "Calls to each instrumented method.",
+            [({"method": name}, call["count"]) for name, call in calls])
+        metric(
+            "call_seconds_total",
+            "counter",
+            "Total time spent in each instrumented method, including nested calls.",
+            [({"method": name}, repr(call["seconds"])) for name, call in calls])
+        metric(
+            "table_draws_total",
+            "counter",
+            "Draws of each entry of each table.",
+            [
+                ({"table": table, "entry": entry}, count)
+                for table, counts in sorted(snapshot["tables"].items())
+                for entry, count in sorted(counts.items())
+            ])
+        metric(
+            "template_draws_total",
+            "counter",
+            "Choices of each name template, by kind of name and template index.",
+            [
+                ({"kind": kind, "template": str(index)}, count)
+                for kind, counts in sorted(snapshot["templates"].items())
+                for index, count in sorted(counts.items())
+            ])
+
+        return "\n".join(lines) + "\n"
+
+
+# Everything recorded while instrumentation is enabled goes here.
+metrics = Metrics()
+
+
+def _add_snapshot(total, snapshot):
+    """
+    Adds the counts and times in one snapshot() to another, in place.
+    """
+    for name, call in snapshot["calls"].items():
+        total_call = total["calls"].setdefault(name, {"count": 0, "seconds": 0.0})
+        total_call["count"] += call["count"]
+        total_call["seconds"] += call["seconds"]
+
+    for section in ("tables", "templates"):
+        for key, counts in snapshot[section].items():
+            total_counts = total[section].setdefault(key, {})
+            for entry, count in counts.items():
+                total_counts[entry] = total_counts.get(entry, 0) + count
+
+
+def worker_snapshot():
+    """
+    Returns a snapshot() of what this worker process has recorded since it was last
+    called, and starts afresh, so each chunk's metrics are only sent back once.
+    """
+    # Workers generate one chunk at a time, so nothing is recorded in between.
+    snapshot = metrics.snapshot()
+    metrics.reset()
+    return snapshot
+
+
+def table_name(table):
+    """
+    Returns a name to report the draws of a table that isn't in the shared table
+    registry under: the name of the enum its entries belong to (like "M_Item"), or
+    failing that, one made from its id.
+    """
+    if table.entries and isinstance(table.entries[0], enum.Enum):
+        return type(table.entries[0]).__name__
+
+    return "table_{:x}".format(id(table))
+
+
+def entry_label(entry):
+    """
+    Returns the text to report a table entry under: an enum member's name, or the
+    entry itself as a string.
+    """
+    return getattr(entry, "name", None) or str(entry)
+
+
+def prometheus_escape(value):
+    """
+    Escapes a Prometheus label value.
+    """
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def enabled():
+    """
+    Returns true if instrumentation is on.
+    """
+    return bool(_originals)
+
+
+def enable(generators=()):
+    """
+    Turns instrumentation on, recompiling the templates of any generators passed in
+    so their draws are counted too.
+    """
+    if enabled():
+        return
+
+    for cls, name in INSTRUMENTED:
+        original = cls.__dict__[name]
+        _originals[(cls, name)] = original
+        setattr(cls, name, _instrumented(cls, name, original))
+
+    for generator in generators:
+        generator.clear_compiled_templates()
+
+
+def disable(generators=()):
+    """
+    Turns instrumentation off, putting the original methods back and recompiling
+    the templates of any generators passed in. What's been recorded is kept.
+    """
+    for (cls, name), original in _originals.items():
+        setattr(cls, name, original)
+    _originals.clear()
+
+    for generator in generators:
+        generator.clear_compiled_templates()
+
+
+def _instrumented(cls, name, original):
+    """
+    Returns a version of a method that records each call with metrics.
+    """
+    method_name = "{}.{}".format(cls.__name__, name)
+    perf_counter = time.perf_counter
+
+    if cls is tables.Table and name == "random":
+        @functools.wraps(original)
+        def random(table, rng=None):
+            start = perf_counter()
+            entry = original(table, rng)
+            metrics.record_call(method_name, perf_counter() - start)
+            metrics.record_draws(table, (entry,))
+            return entry
+
+        return random
+
+    if cls is tables.Table and name == "sample":
+        @functools.wraps(original)
+        def sample(table, k, rng=None):
+            start = perf_counter()
+            entries = original(table, k, rng)
+            metrics.record_call(method_name, perf_counter() - start)
+            metrics.record_draws(table, entries)
+            return entries
+
+        return sample
+
+    item_methods = ("_random_item", "specific_item")
+    if cls is magic_items.M_Item_Generator and name in item_methods:
+        @functools.wraps(original)
+        def random_item(item_gen, general_item_type):
+            start = perf_counter()
+            item = original(item_gen, general_item_type)
+            metrics.record_call(method_name, perf_counter() - start)
+            if general_item_type == magic_items.M_Item.SCROLL:
+                metrics.name_template_table(
+                    item_gen.spell_gen.compiled_templates, "SPELL")
+            else:
+                compiled = item_gen.compiled_templates.get(general_item_type)
+                if compiled is not None:
+                    metrics.name_template_table(compiled, ITEM_TEMPLATE_KIND)
+            return item
+
+        return random_item
+
+    # Compiled templates draw wizard names with the function this returns, rather
+    # than by calling generate_wizard_name(), so each draw is counted as a call to
+    # that instead.
+    if cls is gen.PerilGenerator and name == "wizard_name_draw":
+        wizard_name_method = "{}.generate_wizard_name".format(cls.__name__)
+
+        @functools.wraps(original)
+        def wizard_name_draw(generator, table_names):
+            draw = original(generator, table_names)
+
+            def timed_draw(rng):
+                start = perf_counter()
+                wizard_name = draw(rng)
+                metrics.record_call(wizard_name_method, perf_counter() - start)
+                return wizard_name
+
+            return timed_draw
+
+        return wizard_name_draw
+
+    if cls is spells.Spell_Generator and name == "spell":
+        @functools.wraps(original)
+        def spell(spell_gen):
+            start = perf_counter()
+            name = original(spell_gen)
+            metrics.record_call(method_name, perf_counter() - start)
+            metrics.name_template_table(spell_gen.compiled_templates, "SPELL")
+            return name
+
+        return spell
+
+    @functools.wraps(original)
+    def timed(*args, **kwargs):
+        start = perf_counter()
+        try:
+            return original(*args, **kwargs)
+        finally:
+            metrics.record_call(method_name, perf_counter() - start)
+
+    return timed
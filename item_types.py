@@ -0,0 +1,16 @@
+from enum import Enum
+
+
+# General types of magic items.
+class M_Item(Enum):
+    SCROLL = 1
+    POTION = 2
+    GARB = 3
+    JEWELRY = 4
+    WAND = 5
+    WEAPON = 6
+    ARMOR = 7
+    MISC = 8
+
+
+M_Item_Weights = [1, 3, 1, 2, 1, 1, 1, 2]
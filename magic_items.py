@@ -1,25 +1,13 @@
 from enum import Enum
+from item_types import M_Item, M_Item_Weights
 import generator as gen
 import os
+import packs
+import sampling
 import spells
 import tables
 import templates
-import tools
-
-
-# General types of magic items.
-class M_Item(Enum):
-    SCROLL = 1
-    POTION = 2
-    GARB = 3
-    JEWELRY = 4
-    WAND = 5
-    WEAPON = 6
-    ARMOR = 7
-    MISC = 8
-
-
-M_Item_Weights = [1, 3, 1, 2, 1, 1, 1, 2]
+import unique as uniq
 
 
 # Categories for the magic item name random tables.
@@ -95,155 +83,633 @@ M_ITEM_TEMPLATE_WEIGHTS = [2, 2, 2, 2, 1, 1, 1, 1]
 
 M_ITEM_TEMPLATE_TABLE = tables.Table(M_ITEM_TEMPLATES, M_ITEM_TEMPLATE_WEIGHTS)
 
+# Looks up where a template sits in M_ITEM_TEMPLATES.
+M_ITEM_TEMPLATE_INDEX = {
+    template: index for index, template in enumerate(M_ITEM_TEMPLATES)}
+
+# The specific items come from their own tables, so the magic item text file only
+# has columns for the rest of the fields. Its wizard name columns are the same as
+# the spell tables', so the spell tables are used for both.
+MAGIC_ITEM_PACK = packs.register_pack(packs.TablePack(
+    "magic_items",
+    os.path.join(packs.TABLES_DIR, "MagicItems.json"),
+    M_ItemName,
+    columns=[
+        M_ItemName.NOUN,
+        M_ItemName.ADJECTIVE,
+        M_ItemName.WIZARD_NAME_PRE,
+        M_ItemName.WIZARD_NAME_POST],
+    shared={
+        "WIZARD_NAME_PRE": "spells:WIZARD_NAME_PRE",
+        "WIZARD_NAME_POST": "spells:WIZARD_NAME_POST",
+    }))
+
+# One text file for each item type, like WAND.txt.
+ITEM_PACK = packs.register_pack(packs.TablePack(
+    "items",
+    os.path.join(packs.TABLES_DIR, "Items.json"),
+    M_Item,
+    per_field_files=True))
+
 
 class M_Item_Generator(gen.PerilGenerator):
     """
     Generates random magic item names using Jason Lute's 'Dungeons Monsters Treasure'.
     """
 
-    def __init__(self):
-        self.filename = os.path.join("tables", "MagicItems.json")
-        # magic_item_name_fields = [
-        #     M_ItemName.NOUN,
-        #     M_ItemName.ADJECTIVE,
-        #     M_ItemName.WIZARD_NAME_PRE,
-        #     M_ItemName.WIZARD_NAME_POST]
-
-        # gen.PerilGenerator.__init__(self, self.filename, magic_item_name_fields)
-        gen.PerilGenerator.__init__(self, self.filename, M_ItemName)
+    def __init__(self, rng=None, wizard_pool=False):
+        # Scrolls need a spell generator, but we don't make one until the first
+        # scroll comes up. (Setting the rng below hands it on to the spell
+        # generator, so this has to come first.)
+        self._spell_gen = None
+        gen.PerilGenerator.__init__(self, MAGIC_ITEM_PACK, rng, wizard_pool)
+        self.filename = self.table_file
 
         self.item_types = tables.Table(list(M_Item), M_Item_Weights)
-        self.items = self.init_item_tables()
+        self.item_pack = ITEM_PACK
+        self.items_filename = self.item_pack.json_filename
+        # Like the name tables, the item tables wait until they're first needed.
+        self._items = None
+
+        # The item name templates compiled for each item type, filled in as each
+        # type is first asked for.
+        self.compiled_templates = {}
+        # The ItemTypeGenerator for each item type, built as each type is first
+        # asked for.
+        self.item_type_generators = {}
+
+        # Every name for each item type (or None for items of any type), and how
+        # many there are, worked out as each is first needed.
+        self.name_spaces = {}
+        self.name_space_sizes = {}
+
+    @property
+    def rng(self):
+        """
+        The random number generator every draw goes through, including the spell
+        generator's draws for scrolls.
+        """
+        return self._rng
+
+    @rng.setter
+    def rng(self, rng):
+        self._rng = rng
+        if self._spell_gen is not None:
+            self._spell_gen.rng = rng
 
     def init_item_tables(self):
-        specific_items_filename = os.path.join("tables", "Items.json")
+        return self.item_pack.tables()
 
-        try:
-            items = tools.load_tables(specific_items_filename, M_Item)
-        except FileNotFoundError:
-            item_paths = self.build_item_filepaths()
-            tools.build_item_tables(specific_items_filename, item_paths, M_Item)
-            items = tools.load_tables(specific_items_filename, M_Item)
+    def reload(self):
+        """
+        Re-reads this generator's tables (including the spell tables) from disk.
+        """
+        gen.PerilGenerator.reload(self)
+        self.item_pack.reload()
+        self._items = None
+        self.name_spaces = {}
+        self.name_space_sizes = {}
 
-        return items
+        if self._spell_gen is not None:
+            self._spell_gen.reload()
+
+    def load(self):
+        """
+        Loads the name tables, the item tables and the spell tables used for
+        scrolls, if they aren't loaded already.
+        """
+        gen.PerilGenerator.load(self)
+        if self._items is None:
+            self._items = self.init_item_tables()
+        self.spell_gen.load()
+
+    def is_loaded(self):
+        """
+        Returns true if the name, item and spell tables are all loaded.
+        """
+        return (
+            gen.PerilGenerator.is_loaded(self)
+            and self._items is not None
+            and self._spell_gen is not None
+            and self._spell_gen.is_loaded())
+
+    def clear_compiled_templates(self):
+        """
+        Throws away the compiled item name templates (and the spell generator's),
+        along with the item type generators built on them.
+        """
+        self.compiled_templates = {}
+        self.item_type_generators = {}
+
+        if self._spell_gen is not None:
+            self._spell_gen.clear_compiled_templates()
+
+    @property
+    def items(self):
+        """
+        The tables of specific items for each item type, loaded the first time
+        they're needed.
+        """
+        if self._items is None:
+            self._items = self.init_item_tables()
+
+        return self._items
+
+    @property
+    def spell_gen(self):
+        """
+        The spell generator used for scrolls, created the first time it's needed.
+        """
+        if self._spell_gen is None:
+            self._spell_gen = spells.Spell_Generator(self.rng, self.wizard_pool)
+
+        return self._spell_gen
+
+    def name_space(self, general_item_type=None):
+        """
+        Returns the analysis.NameSpace of every magic item name this generator can
+        produce, either of one type or, if general_item_type is None, of any type.
+        """
+        if general_item_type not in self.name_spaces:
+            # analysis imports this module, so it's imported here rather than at the
+            # top.
+            import analysis
+
+            self.name_spaces[general_item_type] = analysis.item_space(
+                self, general_item_type)
+
+        return self.name_spaces[general_item_type]
+
+    def name_space_size(self, general_item_type=None):
+        """
+        Returns the number of distinct magic item names this generator can produce,
+        either of one type or, if general_item_type is None, of any type.
+        """
+        if general_item_type not in self.name_space_sizes:
+            space = self.name_space(general_item_type)
+            self.name_space_sizes[general_item_type] = space.cardinality()
+
+        return self.name_space_sizes[general_item_type]
+
+    def rank_sampler(self, general_item_type=None):
+        """
+        Returns a sampling.RankSampler that draws every magic item name this
+        generator can produce (of one type, or of any type if general_item_type is
+        None), without repeats, in random order.
+        """
+        return sampling.RankSampler(self.name_space(general_item_type), self.rng)
 
     def build_item_filepaths(self):
         """
         Returns a list of text filenames matching the members of M_Item.
         """
-        item_paths = [item.name + ".txt" for item in M_Item]
-        item_paths = [os.path.join("tables", item) for item in item_paths]
+        return self.item_pack.sources
 
-        return item_paths
+    def records(self, count, subtype=None):
+        """
+        Generates a list of count new random magic items in one batch, of the item
+        type named by subtype (like "WAND"), or of any type if subtype is None.
+        """
+        if subtype is None:
+            return self.magic_item_records(count)
+
+        return self.specific_item_records(M_Item[subtype], count)
 
     def magic_item(self):
         """
         Generates a new random magic item.
         """
-        return self._random_item(self.item_types.random())
+        return self._random_item(self.item_types.random(self.rng))
 
     def specific_item(self, general_item_type):
         """
         Generates a new random magic item of the specified type.
         """
-        return self._random_item(general_item_type)
+        generator = (
+            self.item_type_generators.get(general_item_type)
+            or self.item_type_generator(general_item_type))
+
+        return generator.item()
+
+    def item_type_generator(self, general_item_type):
+        """
+        Returns the ItemTypeGenerator for general_item_type, building it the first
+        time it's asked for.
+        """
+        generator = self.item_type_generators.get(general_item_type)
+        if generator is None:
+            generator = ItemTypeGenerator(self, general_item_type)
+            self.item_type_generators[general_item_type] = generator
+
+        return generator
+
+    def magic_items(self, num_items, unique=False, dedup="exact", by_rank=False):
+        """
+        Generates a list of num_items new random magic items in one batch.
+
+        If unique is true, every name in the list is different, and dedup picks how
+        names already generated are remembered ("exact" or "bloom", see unique.py).
+        Asking for more than unique.MAX_FILL of the possible names fails, unless
+        by_rank is true too: then the names are drawn with rank_sampler(), which
+        can use up every name but ignores the weights of the entries within each
+        template.
+        """
+        if unique:
+            return list(uniq.unique(
+                self.magic_items,
+                num_items,
+                self.name_space_size(),
+                dedup,
+                sampler=(lambda: self.rank_sampler().names()) if by_rank else None))
+
+        return self.by_item_type(self.item_types, num_items, self.specific_items)
+
+    def amagic_items(self, num_items, chunk_size=gen.CHUNK_SIZE, executor=None):
+        """
+        The async counterpart of magic_items(): an async iterator yielding num_items
+        new random magic items in lists of at most chunk_size, for asyncio
+        applications.
+
+        Loading the tables (including the spell tables for scrolls) and generating
+        big chunks happen in executor (the event loop's default executor if it's
+        None), so the event loop isn't blocked.
+        """
+        return self.agenerate(self.magic_items, num_items, chunk_size, executor)
+
+    def aspecific_items(
+            self,
+            general_item_type,
+            num_items,
+            chunk_size=gen.CHUNK_SIZE,
+            executor=None):
+        """
+        The async counterpart of specific_items(), working like amagic_items().
+        """
+        return self.agenerate(
+            lambda count: self.specific_items(general_item_type, count),
+            num_items,
+            chunk_size,
+            executor)
+
+    def specific_items(
+            self,
+            general_item_type,
+            num_items,
+            unique=False,
+            dedup="exact",
+            by_rank=False):
+        """
+        Generates a list of num_items new random magic items of the specified type in
+        one batch.
+
+        unique, dedup and by_rank work as they do for magic_items().
+        """
+        if unique:
+            sampler = None
+            if by_rank:
+                def sampler():
+                    return self.rank_sampler(general_item_type).names()
+
+            return list(uniq.unique(
+                lambda count: self.specific_items(general_item_type, count),
+                num_items,
+                self.name_space_size(general_item_type),
+                dedup,
+                sampler=sampler))
+
+        return self.item_type_generator(general_item_type).items(num_items)
+
+    def magic_item_records(
+            self, num_items, unique=False, dedup="exact", by_rank=False):
+        """
+        Generates a list of num_items new random magic items in one batch, each as a
+        GeneratedName recording its item type and the template it was made from.
+
+        unique, dedup and by_rank work as they do for magic_items().
+        """
+        if unique:
+            return list(uniq.unique(
+                self.magic_item_records,
+                num_items,
+                self.name_space_size(),
+                dedup,
+                sampler=self.rank_sampler if by_rank else None))
+
+        return self.by_item_type(
+            self.item_types, num_items, self.specific_item_records)
+
+    def specific_item_records(
+            self,
+            general_item_type,
+            num_items,
+            unique=False,
+            dedup="exact",
+            by_rank=False):
+        """
+        Generates a list of num_items new random magic items of the specified type in
+        one batch, each as a GeneratedName.
+
+        Scrolls don't use the item name templates, so a scroll's template is the
+        index of the spell name template used for the spell inscribed on it. unique,
+        dedup and by_rank work as they do for magic_items().
+        """
+        if unique:
+            sampler = None
+            if by_rank:
+                def sampler():
+                    return self.rank_sampler(general_item_type)
+
+            return list(uniq.unique(
+                lambda count: self.specific_item_records(general_item_type, count),
+                num_items,
+                self.name_space_size(general_item_type),
+                dedup,
+                sampler=sampler))
+
+        return self.item_type_generator(general_item_type).records(num_items)
+
+    def component_records(self, count, subtype=None, constraints=None):
+        """
+        Generates a list of count new random magic items in one batch as
+        ComponentRecords, of the item type named by subtype (like "WAND") or of
+        random types if it's None.
+        """
+        if subtype is None:
+            return self.magic_item_components(count, constraints)
+
+        return self.specific_item_components(M_Item[subtype], count, constraints)
+
+    def magic_item_components(self, num_items, constraints=None):
+        """
+        Generates a list of num_items new random magic items in one batch, each as a
+        ComponentRecord recording its item type, its template and the entry drawn
+        for each field.
+
+        constraints works as it does for specific_item_components(). The item type
+        of each item is drawn in proportion to how likely an item of that type is
+        to match, so the items come out just as if random items were generated and
+        only the matching ones kept. Raises ValueError if no item can match.
+        """
+        item_types = self.item_types
+        if constraints:
+            types = []
+            weights = []
+            for general_item_type, weight in zip(
+                    item_types.entries, item_types.weights):
+                # Item types that can't match are never drawn: those without a
+                # matching entry, or scrolls when the base item is constrained,
+                # since spells don't have an ITEM field.
+                try:
+                    chance = self.item_type_generator(general_item_type).constrain(
+                        constraints)[2]
+                except ValueError:
+                    continue
+                types.append(general_item_type)
+                weights.append(weight * chance)
+
+            if not types:
+                raise ValueError("No magic item can match {}!".format(constraints))
+            item_types = tables.Table(types, weights)
+
+        return self.by_item_type(
+            item_types,
+            num_items,
+            lambda general_item_type, count: self.specific_item_components(
+                general_item_type, count, constraints))
+
+    def by_item_type(self, item_types, num_items, generate):
+        """
+        Draws num_items item types from the item_types table, and returns a list of
+        one item for each, made by generate (a function taking an item type and a
+        count and returning a list of that many items of the type).
+
+        The draws are grouped by item type so that each type is generated in bulk,
+        then every item is put back where its type was drawn.
+        """
+        groups = {}
+        for position, general_item_type in enumerate(
+                item_types.sample(num_items, self.rng)):
+            groups.setdefault(general_item_type, []).append(position)
+
+        items = [None] * num_items
+        for general_item_type, positions in groups.items():
+            batch = generate(general_item_type, len(positions))
+            for position, item in zip(positions, batch):
+                items[position] = item
+
+        return items
+
+    def specific_item_components(self, general_item_type, num_items, constraints=None):
+        """
+        Generates a list of num_items new random magic items of the specified type
+        in one batch, each as a ComponentRecord.
+
+        constraints optionally maps fields to the entry, or entries, they have to
+        take, like {"ADJECTIVE": "Burning"}. Fields are M_ItemName members or their
+        names, or for scrolls, the Spell_Tables fields of the inscribed spell. Only
+        the matching entries and templates are drawn from, so every item matches.
+        Raises ValueError if no item can.
+        """
+        return self.item_type_generator(general_item_type).components(
+            num_items, constraints)
 
     def scroll(self):
         """
         Generates a new random magic scroll.
         """
-        return self._scroll()
+        return self.specific_item(M_Item.SCROLL)
 
     def potion(self):
         """
         Generates a new random magic potion.
         """
-        return self._random_item(M_Item.POTION)
+        return self.specific_item(M_Item.POTION)
 
     def garb(self):
         """
         Generates a new random piece of magic garb/clothing.
         """
-        return self._random_item(M_Item.GARB)
+        return self.specific_item(M_Item.GARB)
 
     def jewelry(self):
         """
         Generates a new random piece of magic jewelry.
         """
-        return self._random_item(M_Item.JEWELRY)
+        return self.specific_item(M_Item.JEWELRY)
 
     def wand(self):
         """
         Generates a new random magic wand.
         """
-        return self._random_item(M_Item.WAND)
+        return self.specific_item(M_Item.WAND)
 
     def weapon(self):
         """
         Generates a new random magic weapon.
         """
-        return self._random_item(M_Item.WEAPON)
+        return self.specific_item(M_Item.WEAPON)
 
     def armor(self):
         """
         Generates a new random piece of magic armor.
         """
-        return self._random_item(M_Item.ARMOR)
+        return self.specific_item(M_Item.ARMOR)
 
     def misc_item(self):
         """
         Generates a new random miscellaneous magic item.
         """
-        return self._random_item(M_Item.MISC)
+        return self.specific_item(M_Item.MISC)
 
     def _random_item(self, general_item_type):
         """
         Generates a random magic item of general_item_type.
         """
-        # A scroll will have a random spell inscribed on it.
-        if general_item_type == M_Item.SCROLL:
-            return self._scroll()
+        return self.item_type_generator(general_item_type).item()
+
+    def compile_item_templates(self, general_item_type):
+        """
+        Compiles the item name templates for general_item_type against this
+        generator's tables, returning a table of the compiled templates.
+        """
+        compiled = self.compile_template_table(
+            M_ITEM_TEMPLATE_TABLE,
+            M_ItemName,
+            {M_ItemName.ITEM: self.items[general_item_type]})
+        self.compiled_templates[general_item_type] = compiled
+
+        return compiled
+
+    def generate_specific_item(self, general_item_type):
+        """
+        Returns a randomly chosen specific item of general_item_type.
+        """
+        return self.items[general_item_type].random(self.rng)
 
-        item_name_template = M_ITEM_TEMPLATE_TABLE.random()
 
-        item_info = []
-        wizard_name = None
+class ItemTypeGenerator:
+    """
+    Generates magic items of a single item type for an M_Item_Generator, with
+    everything that depends on the type (the compiled templates, this type's item
+    table, or the spell generator for scrolls) looked up once, when it's built.
+
+    M_Item_Generator.item_type_generator() builds one per item type. Its item
+    attribute is a function (taking no arguments) that generates one item of the
+    type, so calling it in a loop skips all of the per-name dispatch on the item
+    type. Every draw uses the M_Item_Generator's rng as it is at the time, so
+    giving it a new one also changes what this generates.
+    """
 
-        # Get a random entry for each category in the item name template.
-        for table in item_name_template.fields:
-            # Wizard names are split into prefixes and suffixes across two
-            # tables, so when the prefix table comes up, we'll generate
-            # the whole name, then skip the suffix when it comes up next (since
-            # we don't want to accidentally generate two wizard names).
-            if self.is_wizard_name(table, M_ItemName):
-                if wizard_name is None:
-                    wizard_name = self.generate_wizard_name(M_ItemName)
-                    item_info.append(wizard_name)
+    def __init__(self, item_gen, general_item_type):
+        self.item_gen = item_gen
+        self.item_type = general_item_type
+        self.kind = general_item_type.name
 
-            elif table == M_ItemName.ITEM:
-                item = self.generate_specific_item(general_item_type)
-                item_info.append(item)
+        # A scroll has a random spell inscribed on it.
+        if general_item_type == M_Item.SCROLL:
+            spell_gen = item_gen.spell_gen
+            draw_spell = spell_gen.compiled_templates.random
+
+            def item():
+                rng = item_gen.rng
+                return "Scroll of " + draw_spell(rng)(rng)
+
+            self.item = item
+            self.spell_gen = spell_gen
+            return
+
+        # Choosing a compiled template and calling it fills in every field, with
+        # the wizard name and table lookups (including this type's item table) all
+        # worked out ahead of time.
+        compiled = item_gen.compiled_templates.get(general_item_type)
+        if compiled is None:
+            compiled = item_gen.compile_item_templates(general_item_type)
+        draw_template = compiled.random
+
+        def item():
+            rng = item_gen.rng
+            return draw_template(rng)(rng)
+
+        self.item = item
+        self.spell_gen = None
+        # Batches fill the item slot of every template from this type's table.
+        self.special_fields = {
+            M_ItemName.ITEM: item_gen.items[general_item_type].sample}
+
+    def items(self, num_items):
+        """
+        Generates a list of num_items new random magic items of this type in one
+        batch.
+        """
+        if self.spell_gen is not None:
+            spell_names = self.spell_gen.spells(num_items)
+            return ["Scroll of {}".format(spell) for spell in spell_names]
 
-            else:
-                feature = self.tables[table].random()
-                item_info.append(feature)
+        return self.item_gen.fill_templates(
+            M_ITEM_TEMPLATE_TABLE, M_ItemName, num_items, self.special_fields)
 
-        name_string = item_name_template.string
+    def records(self, num_items):
+        """
+        Generates a list of num_items new random magic items of this type in one
+        batch, each as a GeneratedName (see M_Item_Generator.specific_item_records).
+        """
+        kind = self.kind
 
-        # # We have to unpack the item info list for this string formatting to work.
-        item_name = name_string.format(*item_info)
-        return item_name
+        if self.spell_gen is not None:
+            return [
+                gen.GeneratedName(
+                    "Scroll of {}".format(spell.name), kind, spell.template)
+                for spell in self.spell_gen.spell_records(num_items)
+            ]
 
-    def generate_specific_item(self, general_item_type):
+        names, chosen = self.item_gen.fill_templates_with_choices(
+            M_ITEM_TEMPLATE_TABLE, M_ItemName, num_items, self.special_fields)
+
+        return [
+            gen.GeneratedName(name, kind, M_ITEM_TEMPLATE_INDEX[template])
+            for name, template in zip(names, chosen)
+        ]
+
+    def constrain(self, constraints):
         """
-        Returns a randomly chosen specific item of general_item_type.
+        Narrows down the templates and tables for this item type to only make
+        items matching constraints (see PerilGenerator.constrain()), returning the
+        template table, the field tables and the chance of a random item of this
+        type matching.
         """
-        return self.items[general_item_type].random()
+        if self.spell_gen is not None:
+            return self.spell_gen.constrain(
+                spells.SPELL_NAME_TEMPLATE_TABLE, spells.Spell_Tables, constraints)
+
+        return self.item_gen.constrain(
+            M_ITEM_TEMPLATE_TABLE,
+            M_ItemName,
+            constraints,
+            {M_ItemName.ITEM: self.item_gen.items[self.item_type]})
 
-    def _scroll(self):
+    def components(self, num_items, constraints=None):
         """
-        Generates a scroll with a random spell inscribed on it.
+        Generates a list of num_items new random magic items of this type in one
+        batch, each as a ComponentRecord (see
+        M_Item_Generator.specific_item_components).
         """
-        spell_gen = spells.Spell_Generator()
-        spell_name = spell_gen.spell()
-        return "Scroll of {}".format(spell_name)
+        kind = self.kind
+
+        if self.spell_gen is not None:
+            return [
+                gen.ComponentRecord(
+                    "Scroll of {}".format(spell.name),
+                    kind,
+                    spell.template,
+                    spell.components)
+                for spell in self.spell_gen.spell_components(num_items, constraints)
+            ]
+
+        template_table, field_tables, _ = self.constrain(constraints)
+        names, chosen, components = self.item_gen.fill_templates_with_components(
+            template_table, M_ItemName, num_items, field_tables)
+
+        return [
+            gen.ComponentRecord(name, kind, M_ITEM_TEMPLATE_INDEX[template], parts)
+            for name, template, parts in zip(names, chosen, components)
+        ]
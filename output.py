@@ -0,0 +1,108 @@
+import csv
+import io
+import json
+
+# The ways generated names can be written out.
+FORMATS = ["text", "jsonl", "csv"]
+
+# How many bytes of output to collect before writing them out in stream mode.
+BUFFER_SIZE = 1 << 20
+
+
+def format_records(records, output_format="text"):
+    """
+    Yields each GeneratedName in records as a line of text (ending in a newline) in
+    the given output format.
+
+    Plain text is just the name. JSON lines and CSV also include the kind of thing
+    named and the index of the template used.
+    """
+    if output_format == "jsonl":
+        for record in records:
+            yield json.dumps(
+                {"name": record.name, "type": record.kind, "template": record.template}
+            ) + "\n"
+
+    elif output_format == "csv":
+        # The csv module writes to a file, so we'll give it one we can empty out
+        # after every row.
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        writer.writerow(["name", "type", "template"])
+        for record in records:
+            writer.writerow(record)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+        # Only the header row is left if there weren't any records.
+        if buffer.getvalue():
+            yield buffer.getvalue()
+
+    elif output_format == "text":
+        for record in records:
+            yield record.name + "\n"
+
+    else:
+        raise ValueError("Unknown output format {}!".format(output_format))
+
+
+def format_hoards(hoards, output_format="text"):
+    """
+    Yields each Hoard in hoards (see hoard.py) as text in the given output format.
+
+    Plain text is a "Hoard N:" heading (counting from 1) followed by its item
+    names, indented. JSON lines has one line per hoard, with its items as a list.
+    CSV has one row per item, starting with the number of the hoard it's in.
+    """
+    if output_format == "jsonl":
+        for hoard in hoards:
+            items = [
+                {"name": item.name, "type": item.kind, "template": item.template}
+                for item in hoard.items
+            ]
+            yield json.dumps({"hoard": hoard.index + 1, "items": items}) + "\n"
+
+    elif output_format == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        writer.writerow(["hoard", "name", "type", "template"])
+        for hoard in hoards:
+            writer.writerows((hoard.index + 1,) + tuple(item) for item in hoard.items)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+        if buffer.getvalue():
+            yield buffer.getvalue()
+
+    elif output_format == "text":
+        for hoard in hoards:
+            lines = ["Hoard {}:\n".format(hoard.index + 1)]
+            lines.extend("  {}\n".format(item.name) for item in hoard.items)
+            yield "".join(lines)
+
+    else:
+        raise ValueError("Unknown output format {}!".format(output_format))
+
+
+def write_buffered(lines, stream, buffer_size=BUFFER_SIZE):
+    """
+    Writes lines of text to a binary stream, collecting them into chunks of roughly
+    buffer_size bytes so there's one write per chunk rather than one per line.
+    """
+    pending = []
+    pending_size = 0
+
+    for line in lines:
+        pending.append(line)
+        pending_size += len(line)
+        if pending_size >= buffer_size:
+            stream.write("".join(pending).encode("utf-8"))
+            pending = []
+            pending_size = 0
+
+    if pending:
+        stream.write("".join(pending).encode("utf-8"))
+
+    stream.flush()
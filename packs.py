@@ -0,0 +1,195 @@
+import atexit
+import contextlib
+import functools
+import os
+import threading
+import tools
+
+# The directory the built-in tables live in. Table files are always found by
+# absolute path, so the generators work from any working directory.
+TABLES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tables")
+
+# The resource files (see resource_filename()) kept available until the program
+# exits, which for a zipped package means extracted to temporary files.
+_resource_files = contextlib.ExitStack()
+atexit.register(_resource_files.close)
+
+# Every registered table pack, by name.
+_packs = {}
+_packs_lock = threading.Lock()
+
+
+class TablePack:
+    """
+    A named set of tables, one for each member of an enum of fields, compiled into
+    one JSON file from either:
+
+    - one text file with a column for each field (the default), or
+    - one text file per field, named after it, like WAND.txt (per_field_files).
+
+    shared optionally maps field names to tables from other packs, given as
+    "pack:FIELD" references. Those fields use the other pack's table (the very same
+    object) instead of this pack's own, so tables that several packs have in common
+    are only held once. Their columns in this pack's text file are skipped, and
+    they're left out of its JSON and compiled table files.
+    """
+
+    def __init__(
+            self,
+            name,
+            json_filename,
+            fields,
+            columns=None,
+            per_field_files=False,
+            shared=None):
+        self.name = name
+        self.json_filename = os.path.abspath(json_filename)
+        self.fields = fields
+        # The fields that each column of the text file holds, in order.
+        self.columns = list(fields) if columns is None else columns
+        self.per_field_files = per_field_files
+        self.shared = {} if shared is None else shared
+
+        if per_field_files:
+            directory = os.path.dirname(self.json_filename)
+            self.sources = [
+                os.path.join(directory, field.name + ".txt") for field in fields]
+        else:
+            self.sources = [tools.text_filename(self.json_filename)]
+
+    def reader(self):
+        """
+        Returns a function that reads this pack's text files into a dictionary of
+        tables. It can be pickled, so it can be run in another process.
+        """
+        if self.per_field_files:
+            read = functools.partial(tools.read_item_tables, self.sources, self.fields)
+        else:
+            read = functools.partial(tools.read_tables, self.sources[0], self.columns)
+
+        if not self.shared:
+            return read
+
+        return functools.partial(_without_fields, read, self.shared_fields())
+
+    def shared_fields(self):
+        """
+        Returns a frozenset of the fields this pack takes from other packs.
+        """
+        return frozenset(self.fields[field_name] for field_name in self.shared)
+
+    def build(self):
+        """
+        Reads this pack's text files and saves the tables to its JSON file.
+        """
+        tools.save_tables(self.reader()(), self.json_filename)
+
+    def own_tables(self):
+        """
+        Returns this pack's own shared, frozen tables, read from its files, leaving
+        out the fields it takes from other packs.
+        """
+        return tools.shared_tables(
+            self.json_filename,
+            self.fields,
+            build=self.build,
+            sources=self.sources,
+            reader=self.reader(),
+            exclude=self.shared_fields())
+
+    def tables(self):
+        """
+        Returns a dictionary mapping each field to its table, with any shared fields
+        taken from the packs they're shared from.
+        """
+        enum_tables = dict(self.own_tables())
+        for field_name, reference in self.shared.items():
+            enum_tables[self.fields[field_name]] = table(reference)
+
+        return enum_tables
+
+    def reload(self):
+        """
+        Forgets this pack's loaded tables (and those of the packs it shares tables
+        from), so they're read from disk again the next time they're asked for.
+        """
+        tools.reload_tables(self.json_filename)
+        for reference in self.shared.values():
+            get_pack(reference.partition(":")[0]).reload()
+
+
+def register_pack(pack, replace=False):
+    """
+    Adds a table pack to the registry under its name, so generators can find it.
+
+    Registering a second pack with the same name is an error unless replace is true.
+    """
+    with _packs_lock:
+        if pack.name in _packs and not replace:
+            raise ValueError("There's already a table pack named {}!".format(pack.name))
+        _packs[pack.name] = pack
+
+    return pack
+
+
+def get_pack(name):
+    """
+    Returns the registered table pack with the given name.
+    """
+    with _packs_lock:
+        try:
+            return _packs[name]
+        except KeyError:
+            raise KeyError("No table pack named {}!".format(name))
+
+
+def registered_packs():
+    """
+    Returns a list of every registered table pack.
+    """
+    with _packs_lock:
+        return list(_packs.values())
+
+
+def _without_fields(read, fields):
+    """
+    Returns the tables read by calling read, without those for the given fields.
+    """
+    return {
+        field: table
+        for field, table in read().items()
+        if field not in fields
+    }
+
+
+def table(reference):
+    """
+    Returns the table a "pack:FIELD" reference names, like "spells:FORM".
+    """
+    pack_name, _, field_name = reference.partition(":")
+    pack = get_pack(pack_name)
+
+    return pack.tables()[pack.fields[field_name]]
+
+
+def resource_filename(package, resource):
+    """
+    Returns the path of a table file shipped as a resource inside a Python package,
+    for building a TablePack from an installed package of tables.
+
+    If the package is zipped, the file is extracted to a temporary file, which is
+    kept until the program exits.
+    """
+    # Only packs shipped in other packages need this, so it isn't worth importing
+    # for every run.
+    import importlib.resources
+
+    # importlib.resources.files() only arrived in Python 3.9; path() does the same
+    # job before that.
+    if hasattr(importlib.resources, "files"):
+        resource_path = importlib.resources.as_file(
+            importlib.resources.files(package).joinpath(resource))
+    else:
+        resource_path = importlib.resources.path(package, resource)
+
+    return str(_resource_files.enter_context(resource_path))
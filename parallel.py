@@ -0,0 +1,216 @@
+import collections
+import concurrent.futures
+import generator as gen
+import hashlib
+import itertools
+import os
+import random
+import sys
+import tools
+
+# Each worker process builds its generators once, the first time it needs them, and
+# keeps them here for every chunk it's handed after that.
+_worker_generators = {}
+
+# Whether this is a worker process recording metrics for its parent to merge in.
+_worker_instrumented = False
+
+
+def generate(
+        kind,
+        total,
+        workers=None,
+        seed=None,
+        item_type=None,
+        chunk_size=gen.CHUNK_SIZE,
+        ordered=True,
+        lazy_entries=False):
+    """
+    Yields total GeneratedName records of the given kind (a registered generator,
+    like "item" or "spell"), split into chunks and generated across a pool of worker
+    processes.
+
+    For items, item_type picks a specific M_Item, or None for random items. Every
+    chunk draws from its own random stream derived from seed, so the same seed and
+    chunk_size give the same names no matter how many workers there are. With
+    ordered=False, chunks are yielded as soon as they finish instead of in order.
+
+    With lazy_entries=True, the workers read table entries straight from the
+    compiled table files' memory maps, which every process shares, instead of each
+    holding its own copy (see tools.use_lazy_entries()). Memory then stays flat as
+    workers are added, but each draw decodes its entry, so it's slower.
+
+    If instrumentation (see instrument.py) is on, the workers record metrics too,
+    and they're merged into this process's as each chunk comes back.
+    """
+    if kind not in gen.generator_kinds():
+        raise ValueError("Can't generate {} in parallel!".format(kind))
+
+    if seed is None:
+        seed = random.randrange(2 ** 64)
+
+    item_type_name = None if item_type is None else item_type.name
+    tasks = (
+        (kind, item_type_name, count, chunk_seed(seed, index))
+        for index, count in enumerate(chunk_counts(total, chunk_size))
+    )
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    # There's no point paying for a pool with only one worker.
+    if workers <= 1:
+        for task in tasks:
+            yield from _unpack(_run_task(task))
+        return
+
+    # Instrumentation is only ever imported by turning it on, so there's no need to
+    # import it here to find out.
+    instrument = sys.modules.get("instrument")
+    instrumented = instrument is not None and instrument.enabled()
+
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_start_worker,
+            initargs=(lazy_entries, instrumented)) as executor:
+        # Only keep a couple of chunks per worker in flight, so memory doesn't grow
+        # with the total when the consumer is slower than the workers.
+        window = 2 * workers
+        pending = collections.deque()
+
+        for task in tasks:
+            pending.append(executor.submit(_run_task, task))
+            if len(pending) >= window:
+                yield from _unpack(_next_finished(pending, ordered))
+
+        while pending:
+            yield from _unpack(_next_finished(pending, ordered))
+
+
+def batch_generator(kind, workers=None, seed=None, item_type=None, **options):
+    """
+    Returns a function that takes a count and yields that many records from
+    generate(), for callers (like unique.unique()) that ask for names a batch at a
+    time.
+
+    The first batch uses seed itself, so it matches a plain generate() call, and each
+    batch after that gets its own seed derived from it.
+    """
+    if seed is None:
+        seed = random.randrange(2 ** 64)
+
+    batches = itertools.count()
+
+    def generate_batch(count):
+        batch = next(batches)
+        batch_seed = seed if batch == 0 else chunk_seed(seed, "batch{}".format(batch))
+        return generate(kind, count, workers, batch_seed, item_type, **options)
+
+    return generate_batch
+
+
+def chunk_counts(total, chunk_size):
+    """
+    Returns how many names go in each chunk when total names are split into chunks
+    of at most chunk_size.
+    """
+    full_chunks, remainder = divmod(total, chunk_size)
+    counts = [chunk_size] * full_chunks
+    if remainder:
+        counts.append(remainder)
+
+    return counts
+
+
+def chunk_seed(seed, index):
+    """
+    Returns the seed for the random stream of chunk number index, derived from the
+    master seed.
+    """
+    # Hashing the pair keeps neighbouring chunks' streams unrelated, which simply
+    # adding the index to the seed wouldn't.
+    digest = hashlib.sha256("{}:{}".format(seed, index).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big")
+
+
+def _next_finished(pending, ordered):
+    """
+    Removes a finished chunk from pending and returns its records: the oldest chunk
+    if ordered, or whichever finishes first if not.
+    """
+    if ordered:
+        return pending.popleft().result()
+
+    done, _ = concurrent.futures.wait(
+        pending, return_when=concurrent.futures.FIRST_COMPLETED)
+    future = done.pop()
+    pending.remove(future)
+    return future.result()
+
+
+def _unpack(result):
+    """
+    Turns a chunk's columns of names, kinds and templates back into records, merging
+    in the metrics that came with them, if any.
+    """
+    columns, metrics = result
+    if metrics is not None:
+        sys.modules["instrument"].metrics.merge(metrics)
+
+    return map(gen.GeneratedName._make, zip(*columns))
+
+
+def _start_worker(lazy_entries, instrumented):
+    """
+    Sets up a new worker process.
+    """
+    global _worker_instrumented
+
+    tools.use_lazy_entries(lazy_entries)
+    if lazy_entries:
+        # A forked worker starts with a copy of every table its parent had loaded,
+        # which lazy entries only replace once they're loaded again.
+        tools.reload_tables()
+
+    if instrumented:
+        import instrument
+
+        # A forked worker starts with instrumentation already on, and a copy of
+        # everything its parent had recorded, which it mustn't send back.
+        instrument.enable()
+        instrument.metrics.reset()
+        _worker_instrumented = True
+
+
+def _generator(kind):
+    """
+    Returns this process's generator for kind, building it the first time.
+    """
+    if kind not in _worker_generators:
+        # Each generator gets its own random number generator, which is reseeded
+        # for every chunk.
+        _worker_generators[kind] = gen.create_generator(kind, random.Random())
+
+    return _worker_generators[kind]
+
+
+def _run_task(task):
+    """
+    Generates one chunk of records from its own seeded random stream, returned as
+    columns of names, kinds and templates, along with the metrics recorded while
+    generating them in a worker process (or None).
+    """
+    kind, item_type_name, count, seed = task
+    generator = _generator(kind)
+
+    generator.rng.seed(seed)
+    records = generator.records(count, item_type_name)
+
+    # Sending plain lists back to the parent process pickles far faster than
+    # sending a list of named tuples.
+    columns = tuple(zip(*records)) if records else ((), (), ())
+
+    if _worker_instrumented:
+        return columns, sys.modules["instrument"].worker_snapshot()
+
+    return columns, None
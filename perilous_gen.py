@@ -1,19 +1,194 @@
-import click
-import magic_items
-import spells
+import time
+
+# Noted before anything else is imported, for --profile-startup.
+STARTED = time.perf_counter()
+
+import click  # noqa: E402
+import functools  # noqa: E402
+import importlib  # noqa: E402
+from item_types import M_Item  # noqa: E402
+import output  # noqa: E402
+import random  # noqa: E402
+import sys  # noqa: E402
+import unique as uniq  # noqa: E402
 
 # RANDOM, SCROLL, POTION, GARB, JEWELRY, WAND, WEAPON, ARMOR, or MISC.
-item_choices = [item.name for item in magic_items.M_Item]
+item_choices = [item.name for item in M_Item]
 item_choices.append("RANDOM")
 
+# How long each lazily imported module took to import, for --profile-startup.
+import_times = {}
+
+
+def lazy_import(name):
+    """
+    Imports and returns the named module.
+
+    The generator modules (and the server and process pool modules, which pull in
+    asyncio and concurrent.futures) are only imported by the commands that use them,
+    so a short run doesn't pay to import everything.
+    """
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    import_times.setdefault(name, time.perf_counter() - start)
+
+    return module
+
 
 @click.group()
-def gen():
+@click.option("--profile-startup", is_flag=True,
+              help="Report how long imports and table loading took, on stderr.")
+@click.option("--metrics", "metrics_file", type=click.Path(dir_okay=False),
+              help="Count and time table draws and name generation (in every "
+                   "worker process too), and write the results to this file.")
+@click.option("--metrics-format", type=click.Choice(["json", "prometheus"]),
+              default="json", show_default=True,
+              help="Write --metrics as JSON or in the Prometheus text format.")
+@click.pass_context
+def gen(ctx, profile_startup, metrics_file, metrics_format):
     """
     Generate random magic items or spells using Jason Lutes'
     "Dungeons Monsters Treasure".
     """
-    pass
+    if profile_startup:
+        imported = time.perf_counter()
+        ctx.call_on_close(lambda: report_startup(imported))
+
+    if metrics_file:
+        # Turned on before any generators exist, so every one of them is counted.
+        instrument = lazy_import("instrument")
+        instrument.enable()
+        ctx.call_on_close(
+            lambda: write_metrics(instrument.metrics, metrics_file, metrics_format))
+
+
+def write_metrics(metrics, metrics_file, metrics_format):
+    """
+    Writes out what instrumentation recorded.
+    """
+    if metrics_format == "prometheus":
+        text = metrics.to_prometheus()
+    else:
+        text = metrics.to_json()
+
+    with open(metrics_file, "w", encoding="utf-8") as file:
+        file.write(text)
+
+
+def report_startup(imported):
+    """
+    Writes out how long the command line tool spent importing modules and loading
+    tables, and how long it ran for altogether.
+    """
+    finished = time.perf_counter()
+
+    def line(label, seconds):
+        click.echo("{:<40} {:>9.1f} ms".format(label, seconds * 1000), err=True)
+
+    click.echo("Startup profile:", err=True)
+    line("import click and set up commands", imported - STARTED)
+    for name, seconds in import_times.items():
+        line("import {}".format(name), seconds)
+
+    # If nothing imported tools, no tables were loaded.
+    tools = sys.modules.get("tools")
+    load_times = {} if tools is None else tools.load_times
+    for filename, seconds in load_times.items():
+        line("load {}".format(filename), seconds)
+    line("total (including generation)", finished - STARTED)
+
+
+def generation_options(command):
+    """
+    Adds the options for choosing how names are generated and written out to a
+    command.
+    """
+    command = click.option(
+        "--by-rank",
+        is_flag=True,
+        help="With --unique, draw names by rank instead of at random. This can use "
+             "up every possible name, but picks evenly among each template's "
+             "entries, ignoring their weights.")(command)
+    command = click.option(
+        "--dedup",
+        type=click.Choice(uniq.DEDUP_METHODS, case_sensitive=False),
+        default="exact",
+        show_default=True,
+        help="How --unique remembers names: every name exactly, or a Bloom filter that "
+             "uses less memory but skips the odd new name.")(command)
+    command = click.option(
+        "-u", "--unique",
+        is_flag=True,
+        help="Never generate the same name twice. Names keep their usual weights, "
+             "so asking for more than 90% of the possible names fails unless "
+             "--by-rank is given too.")(command)
+    command = click.option(
+        "-s", "--seed",
+        type=int,
+        default=None,
+        help="Seed for the random number generator, to reproduce a run.")(command)
+    command = click.option(
+        "-w", "--workers",
+        type=click.IntRange(min=1),
+        default=1,
+        show_default=True,
+        help="Number of processes to generate names in.")(command)
+    command = click.option(
+        "--buffer-size",
+        type=click.IntRange(min=1),
+        default=output.BUFFER_SIZE,
+        show_default=True,
+        help="Bytes of output to collect per write in stream mode.")(command)
+    command = click.option(
+        "--stream",
+        is_flag=True,
+        help="Write output in large buffered chunks instead of line by line.")(command)
+    command = click.option(
+        "-f", "--format", "output_format",
+        type=click.Choice(output.FORMATS, case_sensitive=False),
+        default="text",
+        help="Plain names, or JSON lines/CSV with the type and template too.")(command)
+    return command
+
+
+def announce(message, output_format, stream):
+    """
+    Tells the user what's being generated, keeping the message out of the way of
+    any output meant for other programs to read.
+    """
+    click.echo(message, err=stream or output_format != "text")
+
+
+def write_records(records, output_format, stream, buffer_size):
+    """
+    Writes generated records to standard output in the chosen format.
+    """
+    lines = output.format_records(records, output_format)
+
+    if stream:
+        output.write_buffered(lines, sys.stdout.buffer, buffer_size)
+    else:
+        for line in lines:
+            click.echo(line, nl=False)
+
+
+def constraint_option(field, help_text, flag=None):
+    """
+    Returns an option for generating only names whose field takes one of the given
+    entries.
+    """
+    flag = "--" + field.lower() if flag is None else flag
+    return click.option(
+        flag, field, multiple=True, metavar="ENTRY",
+        help=help_text + " Can be given more than once, to allow any of them.")
+
+
+def constraints_from(**fields):
+    """
+    Returns a dictionary mapping field names to the entries they have to take, for
+    every constraint option that was given.
+    """
+    return {field.upper(): entries for field, entries in fields.items() if entries}
 
 
 @gen.command()
@@ -21,50 +196,395 @@ def gen():
 @click.option("-i", "--item",
               type=click.Choice(item_choices, case_sensitive=False),
               default="RANDOM")
-def item(num_items, item):
+@constraint_option("adjective", "Only generate items with this adjective.")
+@constraint_option("noun", "Only generate items with this noun.")
+@constraint_option(
+    "item_name", "Only generate items that are this, like Sword.", flag="--base")
+@generation_options
+def item(
+        num_items,
+        item,
+        adjective,
+        noun,
+        item_name,
+        output_format,
+        stream,
+        buffer_size,
+        workers,
+        seed,
+        unique,
+        dedup,
+        by_rank):
     """
     Generate random magic items.
 
     NUM_ITEMS is the number of magic items to generate.
     """
-    if item == "RANDOM":
-        click.echo("Generating {} random item(s)...".format(num_items))
-        random_item(num_items, item)
+    # The specific item's field is called ITEM, which --item already means.
+    constraints = constraints_from(adjective=adjective, noun=noun, item=item_name)
+    item_type = None if item == "RANDOM" else M_Item[item]
+    load_tables("item", item_type)
+
+    if item_type is None:
+        announce(
+            "Generating {} random item(s)...".format(num_items), output_format, stream)
+    else:
+        announce(
+            "Generating {} random {}...".format(num_items, item.casefold()),
+            output_format,
+            stream)
+
+    records = generate_records(
+        "item",
+        num_items,
+        workers,
+        seed,
+        unique,
+        dedup,
+        item_type,
+        constraints,
+        by_rank)
+    write_records(records, output_format, stream, buffer_size)
+
+
+@gen.command()
+@click.argument("num_items", type=int, default=1)
+@constraint_option("adjective", "Only generate spells with this adjective.")
+@constraint_option("noun", "Only generate spells with this noun.")
+@constraint_option("form", "Only generate spells of this form, like Bolt.")
+@generation_options
+def spell(
+        num_items,
+        adjective,
+        noun,
+        form,
+        output_format,
+        stream,
+        buffer_size,
+        workers,
+        seed,
+        unique,
+        dedup,
+        by_rank):
+    """
+    Generate random spells.
+
+    NUM_ITEMS is the number of spells to generate.
+    """
+    constraints = constraints_from(adjective=adjective, noun=noun, form=form)
+    load_tables("spell")
+    announce(
+        "Generating {} random spell(s)...".format(num_items), output_format, stream)
+
+    records = generate_records(
+        "spell",
+        num_items,
+        workers,
+        seed,
+        unique,
+        dedup,
+        constraints=constraints,
+        by_rank=by_rank)
+    write_records(records, output_format, stream, buffer_size)
+
+
+@gen.command()
+@click.argument("num_hoards", type=click.IntRange(min=0), default=1)
+@click.option("-c", "--count", "counts", multiple=True, metavar="TYPE=N",
+              help="Put N items of TYPE in every hoard. Can be given more than "
+                   "once.")
+@click.option("-r", "--random", "random_items", type=click.IntRange(min=0),
+              default=None,
+              help="Put this many items of randomly drawn types in every hoard "
+                   "(defaults to 10, or none if --count is given).")
+@click.option("--weight", "weights", multiple=True, metavar="TYPE=W",
+              help="Draw random items' types from these weights instead of the "
+                   "usual ones. Can be given more than once.")
+@click.option("-s", "--seed", type=int, default=None,
+              help="Seed for the random number generator, to reproduce a run.")
+@click.option("-f", "--format", "output_format",
+              type=click.Choice(output.FORMATS, case_sensitive=False),
+              default="text",
+              help="Plain text, JSON lines (a line per hoard) or CSV (a row per "
+                   "item).")
+@click.option("--stream", is_flag=True,
+              help="Write output in large buffered chunks instead of hoard by "
+                   "hoard.")
+def hoard(num_hoards, counts, random_items, weights, seed, output_format, stream):
+    """
+    Generate hoards of random magic items.
+
+    NUM_HOARDS is the number of hoards to generate.
+    """
+    hoard_module = lazy_import("hoard")
+    magic_items = lazy_import("magic_items")
+
+    try:
+        counts = hoard_module.parse_item_counts(counts)
+        weights = hoard_module.parse_item_counts(weights, "weight") or None
+        if random_items is None:
+            random_items = 0 if counts else hoard_module.DEFAULT_HOARD_SIZE
+        spec = hoard_module.HoardSpec(counts, random_items, weights)
+    except ValueError as error:
+        raise click.BadParameter(str(error))
+
+    load_tables("item")
+    announce(
+        "Generating {} hoard(s) of {} item(s)...".format(num_hoards, spec.size()),
+        output_format,
+        stream)
+
+    rng = None if seed is None else random.Random(seed)
+    item_gen = magic_items.M_Item_Generator(rng)
+    hoards = hoard_module.generate_hoards(item_gen, spec, num_hoards)
+    lines = output.format_hoards(hoards, output_format)
+
+    if stream:
+        output.write_buffered(lines, sys.stdout.buffer)
+    else:
+        for line in lines:
+            click.echo(line, nl=False)
+
+
+def load_tables(kind, item_type=None):
+    """
+    Loads the tables a kind of generator will draw from (for items, just those for
+    item_type, unless it's None), compiling any whose text files have changed, so a
+    mistake in one is reported as a plain error message before anything is
+    generated.
+    """
+    generator = lazy_import("generator")
+    tools = lazy_import("tools")
+    module_name = generator.generator_module(kind)
+    if module_name is not None:
+        lazy_import(module_name)
+
+    # The tables go into the shared registry, so the generators that go on to use
+    # them (in this process) don't load them again.
+    try:
+        name_gen = generator.create_generator(kind)
+        if item_type is None:
+            name_gen.load()
+        else:
+            # Only the tables this item type's generator is built on, like the
+            # spell tables for scrolls.
+            name_gen.item_type_generator(item_type)
+    except tools.TableSourceError as error:
+        raise click.ClickException(str(error))
+
+
+def generate_records(
+        kind,
+        total,
+        workers,
+        seed,
+        unique,
+        dedup,
+        item_type=None,
+        constraints=None,
+        by_rank=False):
+    """
+    Returns an iterator of total GeneratedName records of the given kind ("item" or
+    "spell"), generated in chunks.
+    """
+    if by_rank and not unique:
+        raise click.UsageError("--by-rank only works with --unique.")
+
+    if constraints:
+        return generate_constrained(kind, total, workers, seed, unique, item_type,
+                                    constraints)
+
+    # Seeded runs always go through the parallel path (in this process, if there's
+    # only one worker) so the same seed gives the same names no matter how many
+    # workers there are.
+    in_parallel = workers > 1 or seed is not None
+    if in_parallel and not unique:
+        parallel = lazy_import("parallel")
+        return parallel.generate(kind, total, workers, seed, item_type=item_type)
+
+    # Only unique runs get here when seeded, and a rank sampler needs seeding too.
+    rng = None if seed is None else random.Random(seed)
+
+    generator = lazy_import("generator")
+    if kind == "spell":
+        spells = lazy_import("spells")
+        name_gen = spells.Spell_Generator(rng)
+        generate = name_gen.spell_records
+    else:
+        magic_items = lazy_import("magic_items")
+        name_gen = magic_items.M_Item_Generator(rng)
+        if item_type is None:
+            generate = name_gen.magic_item_records
+        else:
+            # The item type's own generator has its tables bound already.
+            generate = name_gen.item_type_generator(item_type).records
+
+    if not unique:
+        return generator.chunked(generate, total)
+
+    if kind == "spell":
+        space_size = name_gen.name_space_size()
     else:
-        click.echo("Generating {} random {}...".format(num_items, item.casefold()))
-        specific_item(num_items, magic_items.M_Item[item])
+        space_size = name_gen.name_space_size(item_type)
+
+    chunk_size = uniq.CHUNK_SIZE
+    if in_parallel:
+        parallel = lazy_import("parallel")
+        generate = parallel.batch_generator(kind, workers, seed, item_type)
+        # Each batch starts a new process pool, so ask for everything at once and
+        # only top up with more batches to replace duplicates.
+        chunk_size = total
+
+    # Drawing by rank changes how the names are distributed, so it's only done when
+    # asked for.
+    sampler = None
+    if by_rank:
+        if kind == "spell":
+            sampler = name_gen.rank_sampler
+        else:
+            sampler = functools.partial(name_gen.rank_sampler, item_type)
+
+    return report_exhaustion(uniq.unique(
+        generate, total, space_size, dedup, chunk_size=chunk_size, sampler=sampler))
 
 
-def random_item(num_items, item):
+def generate_constrained(kind, total, workers, seed, unique, item_type, constraints):
     """
-    Generate num_items random magic items.
+    Returns an iterator of total GeneratedName records of the given kind whose
+    fields match constraints (a dictionary mapping field names to the entries they
+    have to take), generated in chunks.
     """
-    item_gen = magic_items.M_Item_Generator()
-    for i in range(num_items):
-        click.echo(item_gen.magic_item())
+    if unique:
+        raise click.UsageError(
+            "Names with a given adjective, noun, base item or form can't be made "
+            "unique.")
+    if workers > 1:
+        raise click.UsageError(
+            "Names with a given adjective, noun, base item or form are generated in "
+            "one process.")
+
+    generator = lazy_import("generator")
+    rng = None if seed is None else random.Random(seed)
+    name_gen = generator.create_generator(kind, rng)
+    subtype = None if item_type is None else item_type.name
+
+    # Checking the constraints up front turns any that nothing can match into a
+    # plain error message before anything is written.
+    try:
+        name_gen.component_records(0, subtype, constraints)
+    except ValueError as error:
+        raise click.UsageError(str(error))
+
+    def generate(count):
+        return [
+            generator.GeneratedName(*record[:3])
+            for record in name_gen.component_records(count, subtype, constraints)
+        ]
 
+    return generator.chunked(generate, total)
 
-def specific_item(num_items, item_type):
+
+def report_exhaustion(records):
     """
-    Generate num_items random magic items of the specified type.
+    Yields records, turning running out of unique names into a plain error message.
     """
-    item_gen = magic_items.M_Item_Generator()
-    for i in range(num_items):
-        click.echo(item_gen.specific_item(item_type))
+    try:
+        yield from records
+    except uniq.NameSpaceExhausted as error:
+        raise click.ClickException(str(error))
 
 
 @gen.command()
-@click.argument("num_items", type=int, default=1)
-def spell(num_items):
+@click.option("-n", "--samples", type=click.IntRange(min=1), default=None,
+              help="Number of draws for each check (defaults to 200000).")
+@click.option("-t", "--test", type=click.Choice(["chi2", "g"]), default="chi2",
+              show_default=True, help="Pearson's chi-square test or the G-test.")
+@click.option("-a", "--alpha", type=float, default=None,
+              help="Fail a check whose p-value is below this (defaults to 0.0001).")
+@click.option("-s", "--seed", type=int, default=None,
+              help="Seed for the random number generator, to reproduce a run.")
+def check(samples, test, alpha, seed):
     """
-    Generate random spells.
+    Check that generated tables, item types and templates come up as often as their
+    weights say they should.
 
-    NUM_ITEMS is the number of spells to generate.
+    Exits with status 1 if any check fails.
+    """
+    conformance = lazy_import("conformance")
+    samples = conformance.DEFAULT_SAMPLES if samples is None else samples
+    alpha = conformance.DEFAULT_ALPHA if alpha is None else alpha
+    rng = None if seed is None else random.Random(seed)
+
+    failures = 0
+    for result in conformance.run_checks(samples, rng, test, alpha):
+        failures += not result.passed
+        click.echo("{:<34} {:>4} bins {:>12.2f} p={:<10.4g}{}".format(
+            result.name,
+            result.bins,
+            result.statistic,
+            result.p_value,
+            "" if result.passed else "  FAIL"))
+
+    if failures:
+        click.echo("{} check(s) failed.".format(failures), err=True)
+        sys.exit(1)
+
+
+@gen.command(name="compile")
+@click.option("--force", is_flag=True,
+              help="Rebuild every table file, even ones that haven't changed.")
+@click.option("-w", "--workers", type=click.IntRange(min=1), default=None,
+              help="Number of processes to compile in (defaults to one per CPU).")
+def compile_tables(force, workers):
+    """
+    Compile the table text files into JSON and compiled table files, checking them
+    for mistakes.
+
+    Only table files whose text files have changed are rebuilt.
+    """
+    table_compiler = lazy_import("table_compiler")
+    tools = lazy_import("tools")
+
+    try:
+        compiled = table_compiler.compile_tables(workers=workers, force=force)
+    except tools.TableSourceError as error:
+        raise click.ClickException(str(error))
+
+    for json_filename in compiled:
+        click.echo("Compiled {}".format(json_filename))
+    if not compiled:
+        click.echo("All tables are up to date.")
+
+
+@gen.command()
+@click.option("--host", default=None,
+              help="Address to listen on (defaults to 127.0.0.1).")
+@click.option("--port", type=int, default=None,
+              help="Port to listen on (defaults to 8080).")
+@click.option("-s", "--seed", type=int, default=None,
+              help="Seed for the random number generator, to reproduce a run.")
+def serve(host, port, seed):
     """
-    click.echo("Generating {} random spell(s)...".format(num_items))
-    spell_gen = spells.Spell_Generator()
-    for i in range(num_items):
-        click.echo(spell_gen.spell())
+    Serve random magic items and spells over HTTP.
+
+    Ask for /item?type=WAND&n=500 or /spell?n=500, adding format=jsonl or csv for
+    structured output.
+    """
+    server = lazy_import("server")
+    host = server.DEFAULT_HOST if host is None else host
+    port = server.DEFAULT_PORT if port is None else port
+
+    # The server loads each kind's tables when it's first asked for, so check them
+    # all before it starts.
+    for kind in lazy_import("generator").generator_kinds():
+        load_tables(kind)
+
+    rng = None if seed is None else random.Random(seed)
+    click.echo("Serving on http://{}:{} (press Ctrl+C to stop)".format(host, port))
+    try:
+        server.run(host, port, rng)
+    except KeyboardInterrupt:
+        pass
 
 
 if __name__ == "__main__":
@@ -0,0 +1,182 @@
+import generator as gen
+import random
+import tables
+
+# How many rounds of mixing each Feistel permutation does. Four is the fewest that
+# makes a good pseudorandom permutation; this isn't meant to be cryptographically
+# strong, just to scatter neighbouring indices.
+FEISTEL_ROUNDS = 4
+
+# The multiplier from Fibonacci hashing (2**64 divided by the golden ratio), which
+# spreads the bits of whatever it multiplies into the top bits of the product.
+_GOLDEN_64 = 0x9E3779B97F4A7C15
+
+_MASK_64 = (1 << 64) - 1
+
+
+class FeistelPermutation:
+    """
+    A random bijection from range(size) onto itself, computed one index at a time
+    without storing the whole permutation.
+
+    A Feistel network shuffles the bits of a number in a range of an even number of
+    bits, which is at most four times as big as size. Anything that lands outside
+    range(size) is shuffled again ("cycle walking") until it lands inside, which
+    keeps the whole thing a bijection on range(size).
+    """
+
+    def __init__(self, size, rng=None):
+        if rng is None:
+            rng = random
+
+        self.size = size
+        half_bits = max(1, (max(size - 1, 1).bit_length() + 1) // 2)
+        self.half_bits = half_bits
+        self.half_mask = (1 << half_bits) - 1
+        self.keys = [int(rng.random() * (1 << 53)) for _ in range(FEISTEL_ROUNDS)]
+        # Pick odd keys so a key of zero can't leave a round doing nothing.
+        self.keys = [key | 1 for key in self.keys]
+
+    def __call__(self, index):
+        """
+        Returns where index goes in the permutation.
+        """
+        half_bits = self.half_bits
+        half_mask = self.half_mask
+        # Each round's mixing function takes the top bits of a multiplicative hash.
+        shift = 64 - half_bits
+        while True:
+            left, right = index >> half_bits, index & half_mask
+            for key in self.keys:
+                mixed = (((right ^ key) * _GOLDEN_64) & _MASK_64) >> shift
+                left, right = right, left ^ mixed
+            index = (left << half_bits) | right
+            if index < self.size:
+                return index
+
+
+class TemplateSampler:
+    """
+    Hands out the slot value combinations of one analysis.TemplateSpace in a random
+    order, each exactly once.
+
+    The combinations are numbered in mixed radix (the first slot's value is the
+    lowest digit), so a number decodes straight back into one value per slot.
+    """
+
+    def __init__(self, template, earlier, rng=None):
+        self.template = template
+        self.slots = [list(slot) for slot in template.slots]
+        self.radixes = [len(slot) for slot in self.slots]
+        # For each template earlier in the same group (sharing a template string),
+        # the values in each slot that both templates share. Names made only from
+        # shared values could have come from the earlier template, so we skip
+        # them. Templates with nothing in common in some slot can never clash.
+        self.earlier = []
+        for other in earlier:
+            shared = [
+                set(slot) & other_slot.keys()
+                for slot, other_slot in zip(self.slots, other.slots)]
+            if all(shared):
+                self.earlier.append(shared)
+        self.size = template.cardinality()
+        self.permutation = FeistelPermutation(self.size, rng)
+        self.position = 0
+
+    def covered(self):
+        """
+        Returns true if every combination this template has can also come from an
+        earlier template in its group, so it has nothing new to give.
+        """
+        return any(
+            all(len(slot) == len(common) for slot, common in zip(self.slots, shared))
+            for shared in self.earlier)
+
+    def next_values(self):
+        """
+        Returns the next combination of slot values, or None once there are none
+        left.
+        """
+        while self.position < self.size:
+            index = self.permutation(self.position)
+            self.position += 1
+
+            values = []
+            for slot, radix in zip(self.slots, self.radixes):
+                index, digit = divmod(index, radix)
+                values.append(slot[digit])
+
+            if not any(
+                    all(value in common for value, common in zip(values, shared))
+                    for shared in self.earlier):
+                return values
+
+        return None
+
+
+class RankSampler:
+    """
+    Draws distinct names from an analysis.NameSpace without ever repeating one,
+    taking the same time per name however much of the space has been used up.
+
+    Each name is drawn by choosing a template with its usual probability, then
+    taking the next slot value combination from that template's own random
+    permutation of every combination it has. A template drops out once it runs out.
+
+    Because every combination comes up exactly once, the weights of the values
+    within a template can't shape the draw: they're in a uniformly random order.
+    The weights of the templates (and item types) still decide where each name
+    comes from.
+    """
+
+    def __init__(self, space, rng=None):
+        self.rng = rng
+
+        self.samplers = []
+        for group in space.groups.values():
+            for position, template in enumerate(group):
+                sampler = TemplateSampler(template, group[:position], rng)
+                if sampler.size and not sampler.covered():
+                    self.samplers.append(sampler)
+
+        self._choose_from(self.samplers)
+
+    def _choose_from(self, samplers):
+        self.samplers = samplers
+        self.choices = tables.Table(
+            list(range(len(samplers))),
+            [float(sampler.template.probability) for sampler in samplers]).freeze()
+
+    def __iter__(self):
+        """
+        Yields GeneratedName records until every name in the space has been drawn.
+        """
+        while self.samplers:
+            sampler = self.samplers[self.choices.random(self.rng)]
+            values = sampler.next_values()
+            if values is None:
+                self._choose_from([s for s in self.samplers if s is not sampler])
+                continue
+
+            template = sampler.template
+            yield gen.GeneratedName(
+                template.render(values), template.kind, template.index)
+
+    def names(self):
+        """
+        Yields just the names, until every name in the space has been drawn.
+        """
+        for record in self:
+            yield record.name
+
+    def sample(self, count):
+        """
+        Returns a list of the next count records, or fewer if the space runs out.
+        """
+        records = []
+        for record in self:
+            records.append(record)
+            if len(records) == count:
+                break
+
+        return records
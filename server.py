@@ -0,0 +1,234 @@
+import asyncio
+import functools
+import generator as gen
+import itertools
+import output
+import urllib.parse
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8080
+
+# How many names to send in each chunk of a streamed response. Other connections get
+# a turn in between chunks, so one big request can't hold up everyone else.
+STREAM_CHUNK_SIZE = 1000
+
+CONTENT_TYPES = {
+    "text": "text/plain; charset=utf-8",
+    "jsonl": "application/x-ndjson; charset=utf-8",
+    "csv": "text/csv; charset=utf-8",
+}
+
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+}
+
+
+class RequestError(Exception):
+    """
+    Raised when a request can't be answered, carrying the HTTP status to send back.
+    """
+
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+class GenerationServer:
+    """
+    A small HTTP server that keeps its generators (and their tables) loaded between
+    requests, answering:
+
+    /item?type=WAND&n=500    (type defaults to RANDOM, n defaults to 1)
+    /spell?n=500
+
+    along with any other registered kind of generator, at /<kind>. All of them take
+    format=text, jsonl or csv.
+    """
+
+    def __init__(self, rng=None):
+        self.rng = rng
+        # A generator for each kind of name asked for so far.
+        self.generators = {}
+
+    def generator(self, kind):
+        """
+        Returns the server's generator for a registered kind of generator, creating
+        it the first time it's asked for.
+        """
+        if kind not in self.generators:
+            self.generators[kind] = gen.create_generator(kind, self.rng)
+
+        return self.generators[kind]
+
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        """
+        Serves requests on host and port until cancelled.
+        """
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        async with server:
+            await server.serve_forever()
+
+    async def handle_connection(self, reader, writer):
+        """
+        Answers requests from one client connection, for as long as the client keeps
+        the connection open.
+        """
+        try:
+            while True:
+                request = await self.read_request(reader)
+                if request is None:
+                    break
+
+                method, target, version, headers = request
+                keep_alive = wants_keep_alive(version, headers)
+
+                try:
+                    if method != "GET":
+                        raise RequestError(405, "Only GET requests are supported.")
+                    await self.respond(writer, target, version, keep_alive)
+                except RequestError as error:
+                    await self.send_error(writer, error, keep_alive)
+
+                if not keep_alive:
+                    break
+
+        # A client hanging up or sending nonsense just ends its connection.
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+
+        finally:
+            writer.close()
+
+    async def read_request(self, reader):
+        """
+        Reads a request line and its headers, returning the method, target, HTTP
+        version and headers, or None if the client has closed the connection.
+        """
+        request_line = await reader.readline()
+        if not request_line.strip():
+            return None
+
+        method, target, version = request_line.decode("latin-1").split()
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        return method, target, version, headers
+
+    async def respond(self, writer, target, version, keep_alive):
+        """
+        Generates the names a request asks for and streams them back.
+        """
+        url = urllib.parse.urlsplit(target)
+        query = dict(urllib.parse.parse_qsl(url.query))
+
+        count = parse_count(query.get("n", "1"))
+        output_format = query.get("format", "text").lower()
+        if output_format not in output.FORMATS:
+            raise RequestError(400, "Unknown format {}.".format(output_format))
+
+        kind = url.path.strip("/")
+        if kind not in gen.generator_kinds():
+            raise RequestError(404, "Nothing at {}.".format(url.path))
+
+        subtype = query.get("type", "RANDOM").upper()
+        subtype = None if subtype == "RANDOM" else subtype
+        generate = functools.partial(self.generator(kind).records, subtype=subtype)
+        # Asking for no names checks the type before anything is sent.
+        try:
+            generate(0)
+        except (KeyError, ValueError):
+            raise RequestError(400, "Unknown {} type {}.".format(kind, subtype))
+
+        records = gen.chunked(generate, count, STREAM_CHUNK_SIZE)
+        lines = output.format_records(records, output_format)
+
+        # HTTP/1.0 clients don't understand chunked responses, so they get the body
+        # as-is, ended by closing the connection (see wants_keep_alive()).
+        chunked = version != "HTTP/1.0"
+        headers = {"Content-Type": CONTENT_TYPES[output_format]}
+        if chunked:
+            headers["Transfer-Encoding"] = "chunked"
+        headers["Connection"] = "keep-alive" if keep_alive else "close"
+        writer.write(response_head(200, headers))
+
+        while True:
+            body = "".join(itertools.islice(lines, STREAM_CHUNK_SIZE)).encode("utf-8")
+            if not body:
+                break
+            if chunked:
+                writer.write(b"%x\r\n%s\r\n" % (len(body), body))
+            else:
+                writer.write(body)
+            await writer.drain()
+            # Give other connections a turn even if the client is keeping up.
+            await asyncio.sleep(0)
+
+        if chunked:
+            writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def send_error(self, writer, error, keep_alive):
+        """
+        Sends a short plain text response explaining what went wrong.
+        """
+        body = (str(error) + "\n").encode("utf-8")
+        headers = {
+            "Content-Type": CONTENT_TYPES["text"],
+            "Content-Length": str(len(body)),
+            "Connection": "keep-alive" if keep_alive else "close",
+        }
+        writer.write(response_head(error.status, headers) + body)
+        await writer.drain()
+
+
+def parse_count(count):
+    """
+    Returns the number of names asked for, as long as it's a whole number.
+    """
+    try:
+        count = int(count)
+    except ValueError:
+        raise RequestError(400, "n must be a whole number.")
+
+    if count < 0:
+        raise RequestError(400, "n can't be negative.")
+
+    return count
+
+
+def wants_keep_alive(version, headers):
+    """
+    Returns true if the client wants to keep the connection open after this request.
+    """
+    # Responses are streamed with chunked encoding, which HTTP/1.0 doesn't have, so
+    # the only way to end one is to close the connection.
+    if version == "HTTP/1.0":
+        return False
+
+    return headers.get("connection", "").lower() != "close"
+
+
+def response_head(status, headers):
+    """
+    Returns the status line and headers of a response, ready to send.
+    """
+    lines = ["HTTP/1.1 {} {}".format(status, REASONS[status])]
+    lines.extend("{}: {}".format(name, value) for name, value in headers.items())
+
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+def run(host=DEFAULT_HOST, port=DEFAULT_PORT, rng=None):
+    """
+    Starts a generation server and runs it until interrupted.
+    """
+    asyncio.run(GenerationServer(rng).serve(host, port))
@@ -1,8 +1,11 @@
 from enum import Enum
 import generator as gen
 import os
+import packs
+import sampling
 import tables
 import templates
+import unique as uniq
 
 
 # Categories for the spell name random tables.
@@ -90,42 +93,183 @@ SPELL_NAME_TEMPLATE_TABLE = tables.Table(
     SPELL_NAME_TEMPLATES,
     SPELL_NAME_TEMPLATE_WEIGHTS)
 
+# Looks up where a template sits in SPELL_NAME_TEMPLATES.
+SPELL_NAME_TEMPLATE_INDEX = {
+    template: index for index, template in enumerate(SPELL_NAME_TEMPLATES)}
+
+SPELL_PACK = packs.register_pack(packs.TablePack(
+    "spells", os.path.join(packs.TABLES_DIR, "Spells.json"), Spell_Tables))
+
 
 class Spell_Generator(gen.PerilGenerator):
     """
     Generates random spell names using Jason Lute's 'Dungeons Monsters Treasure'.
     """
 
-    def __init__(self):
-        self.filename = os.path.join("tables", "Spells.json")
-        gen.PerilGenerator.__init__(self, self.filename, Spell_Tables)
+    def __init__(self, rng=None, wizard_pool=False):
+        gen.PerilGenerator.__init__(self, SPELL_PACK, rng, wizard_pool)
+        self.filename = self.table_file
+        self._compiled_templates = None
+        # Every spell name this generator can produce, and how many there are,
+        # worked out when first needed.
+        self._name_space = None
+        self._name_space_size = None
+
+    @property
+    def compiled_templates(self):
+        """
+        The spell name templates compiled against this generator's tables, compiled
+        (and the tables loaded) the first time they're needed.
+        """
+        if self._compiled_templates is None:
+            self._compiled_templates = self.compile_template_table(
+                SPELL_NAME_TEMPLATE_TABLE, Spell_Tables)
+
+        return self._compiled_templates
+
+    def reload(self):
+        """
+        Re-reads this generator's tables from disk, picking up any changes.
+        """
+        gen.PerilGenerator.reload(self)
+        self._name_space = None
+        self._name_space_size = None
+
+    def clear_compiled_templates(self):
+        """
+        Throws away the compiled spell name templates.
+        """
+        self._compiled_templates = None
+
+    def name_space(self):
+        """
+        Returns the analysis.NameSpace of every spell name this generator can
+        produce.
+        """
+        if self._name_space is None:
+            # analysis imports this module, so it's imported here rather than at the
+            # top.
+            import analysis
+
+            self._name_space = analysis.spell_space(self)
+
+        return self._name_space
+
+    def name_space_size(self):
+        """
+        Returns the number of distinct spell names this generator can produce.
+        """
+        if self._name_space_size is None:
+            self._name_space_size = self.name_space().cardinality()
+
+        return self._name_space_size
+
+    def rank_sampler(self):
+        """
+        Returns a sampling.RankSampler that draws every spell name this generator
+        can produce, without repeats, in random order.
+        """
+        return sampling.RankSampler(self.name_space(), self.rng)
 
     def spell(self):
         """
         Generates a new random spell name.
         """
-        spell_name_template = SPELL_NAME_TEMPLATE_TABLE.random()
+        # Choosing a compiled template and calling it fills in every field, with
+        # the wizard name and table lookups all worked out ahead of time.
+        return self.compiled_templates.random(self.rng)(self.rng)
 
-        spell_info = []
-        wizard_name = None
+    def spells(self, num_spells, unique=False, dedup="exact", by_rank=False):
+        """
+        Generates a list of num_spells new random spell names in one batch.
+
+        If unique is true, every name in the list is different, and dedup picks how
+        names already generated are remembered ("exact" or "bloom", see unique.py).
+        Asking for more than unique.MAX_FILL of the possible names fails, unless
+        by_rank is true too: then the names are drawn with rank_sampler(), which
+        can use up every name but ignores the weights of the entries within each
+        template.
+        """
+        if unique:
+            return list(uniq.unique(
+                self.spells,
+                num_spells,
+                self.name_space_size(),
+                dedup,
+                sampler=(lambda: self.rank_sampler().names()) if by_rank else None))
+
+        return self.fill_templates(SPELL_NAME_TEMPLATE_TABLE, Spell_Tables, num_spells)
+
+    def aspells(self, num_spells, chunk_size=gen.CHUNK_SIZE, executor=None):
+        """
+        The async counterpart of spells(): an async iterator yielding num_spells new
+        random spell names in lists of at most chunk_size, for asyncio applications.
 
-        # Get a random entry for each category in the spell name template.
-        for table in spell_name_template.fields:
-            # Wizard names are split into prefixes and suffixes across two
-            # tables, so when the prefix table comes up, we'll generate
-            # the whole name, then skip the suffix when it comes up next (since
-            # we don't want to accidentally generate two wizard names).
-            if self.is_wizard_name(table, Spell_Tables):
-                if wizard_name is None:
-                    wizard_name = self.generate_wizard_name(Spell_Tables)
-                    spell_info.append(wizard_name)
+        Loading the tables and generating big chunks happen in executor (the event
+        loop's default executor if it's None), so the event loop isn't blocked.
+        """
+        return self.agenerate(self.spells, num_spells, chunk_size, executor)
+
+    def records(self, count, subtype=None):
+        """
+        Generates a list of count new random spells in one batch. Spells have no
+        subtypes.
+        """
+        if subtype is not None:
+            raise ValueError("Spells don't have a subtype {}!".format(subtype))
+
+        return self.spell_records(count)
 
-            else:
-                feature = self.tables[table].random()
-                spell_info.append(feature)
+    def spell_records(self, num_spells, unique=False, dedup="exact", by_rank=False):
+        """
+        Generates a list of num_spells new random spells in one batch, each as a
+        GeneratedName recording the template it was made from.
 
-        name_string = spell_name_template.string
+        unique, dedup and by_rank work as they do for spells().
+        """
+        if unique:
+            return list(uniq.unique(
+                self.spell_records,
+                num_spells,
+                self.name_space_size(),
+                dedup,
+                sampler=self.rank_sampler if by_rank else None))
+
+        names, chosen = self.fill_templates_with_choices(
+            SPELL_NAME_TEMPLATE_TABLE, Spell_Tables, num_spells)
+
+        return [
+            gen.GeneratedName(name, "SPELL", SPELL_NAME_TEMPLATE_INDEX[template])
+            for name, template in zip(names, chosen)
+        ]
+
+    def component_records(self, count, subtype=None, constraints=None):
+        """
+        Generates a list of count new random spells in one batch, as
+        ComponentRecords. Spells have no subtypes.
+        """
+        if subtype is not None:
+            raise ValueError("Spells don't have a subtype {}!".format(subtype))
+
+        return self.spell_components(count, constraints)
+
+    def spell_components(self, num_spells, constraints=None):
+        """
+        Generates a list of num_spells new random spells in one batch, each as a
+        ComponentRecord recording its template and the entry drawn for each field.
+
+        constraints optionally maps fields (Spell_Tables members or their names) to
+        the entry, or entries, they have to take, like {"ADJECTIVE": "Burning"}.
+        Only the matching entries and templates are drawn from, so every spell
+        matches. Raises ValueError if no spell can.
+        """
+        template_table, field_tables, _ = self.constrain(
+            SPELL_NAME_TEMPLATE_TABLE, Spell_Tables, constraints)
+        names, chosen, components = self.fill_templates_with_components(
+            template_table, Spell_Tables, num_spells, field_tables)
 
-        # We have to unpack the spell info list for this string formatting to work.
-        spell_name = name_string.format(*spell_info)
-        return spell_name
+        return [
+            gen.ComponentRecord(
+                name, "SPELL", SPELL_NAME_TEMPLATE_INDEX[template], parts)
+            for name, template, parts in zip(names, chosen, components)
+        ]
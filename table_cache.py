@@ -0,0 +1,296 @@
+import array
+import collections.abc
+import hashlib
+import itertools
+import json
+import mmap
+import os
+import struct
+import sys
+import tables
+
+# Compiled table files are laid out as:
+#   header     magic, format version and metadata length
+#   metadata   UTF-8 JSON describing the source files and where each table starts
+#   weights    one unsigned 32-bit weight per entry, across all tables
+#   totals     each entry's running total of its table's weights, in the same way
+#   offsets    one unsigned 32-bit offset per entry (plus an end marker) into the blob
+#   blob       every entry's text, UTF-8 encoded and separated by newlines
+# The arrays are padded to start on a 4-byte boundary, so they can be used straight
+# out of a memory map without copying.
+#
+# The memory map is backed by the file in the operating system's page cache, so
+# every process that maps the same file shares one copy of it. With lazy entries
+# (see LazyEntries), nothing else is copied into each process either: tables draw
+# with the running totals and decode entries from the blob straight from the map.
+EXTENSION = ".tblc"
+MAGIC = b"PGTC"
+VERSION = 2
+HEADER = struct.Struct("<4sII")
+ARRAY_TYPE = "I"
+
+
+class CacheError(Exception):
+    """
+    Raised when a compiled table file is missing, damaged, or out of date.
+    """
+
+
+class LazyEntries(collections.abc.Sequence):
+    """
+    A read-only sequence of a table's entries that decodes each one from a compiled
+    table file's blob when it's asked for, instead of holding them all as strings.
+
+    offsets holds the offset of each entry in blob plus the end marker after the
+    last one, so entry i runs from offsets[i] to offsets[i + 1] - 1.
+    """
+
+    def __init__(self, offsets, blob):
+        self._offsets = offsets
+        self._blob = blob
+        self._length = len(offsets) - 1
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[position] for position in range(*index.indices(self._length))]
+
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("entry index out of range")
+
+        offsets = self._offsets
+        return str(self._blob[offsets[index]:offsets[index + 1] - 1], "utf-8")
+
+
+def load_tables(cache_filename, sources, fields, reader, lazy=False):
+    """
+    Returns the tables for fields from a compiled cache file, rebuilding the cache
+    first if it's missing or any of the source text files have changed since it was
+    written.
+
+    reader is called (with no arguments) to parse the sources into a dictionary of
+    Table objects whenever the cache needs rebuilding. If lazy is true, the tables
+    read their entries from the cache as they're drawn (see LazyEntries).
+    """
+    try:
+        return read_cache(cache_filename, sources, fields, lazy)
+    except CacheError:
+        pass
+
+    enum_tables = reader()
+
+    # If we can't write the cache (say, the tables directory is read-only) we'll
+    # still have the tables we just parsed, so it's not worth failing over.
+    try:
+        write_cache(cache_filename, enum_tables, sources)
+    except OSError:
+        return enum_tables
+
+    # Lazy tables have to come from the cache, so read back the one just written.
+    if lazy:
+        try:
+            return read_cache(cache_filename, sources, fields, lazy)
+        except CacheError:
+            pass
+
+    return enum_tables
+
+
+def write_cache(cache_filename, enum_tables, sources):
+    """
+    Compiles enum_tables into a cache file, stamped with the current state of the
+    source text files they were read from.
+    """
+    weights = array.array(ARRAY_TYPE)
+    totals = array.array(ARRAY_TYPE)
+    offsets = array.array(ARRAY_TYPE)
+    encoded = []
+    position = 0
+    layout = []
+
+    for label, table in enum_tables.items():
+        layout.append([label.value, len(weights), len(table.entries)])
+        weights.extend(table.weights)
+        totals.extend(itertools.accumulate(table.weights))
+        for entry in table.entries:
+            offsets.append(position)
+            encoded.append(entry.encode("utf-8"))
+            # Each entry is followed by a newline, which no entry can contain.
+            position += len(encoded[-1]) + 1
+
+    # The end marker sits one past the last entry's (missing) newline, so entry i
+    # always runs from offsets[i] to offsets[i + 1] - 1.
+    offsets.append(position)
+    blob = b"\n".join(encoded)
+
+    cache_dir = os.path.dirname(os.path.abspath(cache_filename))
+    metadata = {
+        "byteorder": sys.byteorder,
+        "itemsize": weights.itemsize,
+        "sources": [source_stamp(source, cache_dir) for source in sources],
+        "tables": layout,
+        "count": len(weights),
+        "blob_size": len(blob),
+    }
+    metadata = json.dumps(metadata).encode("utf-8")
+    padding = b"\0" * (-(HEADER.size + len(metadata)) % weights.itemsize)
+
+    # Write to a temporary file and swap it in, so a reader never sees half a cache.
+    temp_filename = "{}.{}.tmp".format(cache_filename, os.getpid())
+    try:
+        with open(temp_filename, "wb") as file:
+            file.write(HEADER.pack(MAGIC, VERSION, len(metadata)))
+            file.write(metadata)
+            file.write(padding)
+            file.write(weights.tobytes())
+            file.write(totals.tobytes())
+            file.write(offsets.tobytes())
+            file.write(blob)
+        os.replace(temp_filename, cache_filename)
+    finally:
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+
+
+def read_cache(cache_filename, sources, fields, lazy=False):
+    """
+    Returns the tables for fields from a compiled cache file, with their entries as
+    LazyEntries if lazy is true.
+
+    Raises CacheError if the file doesn't exist, can't be read, or is stale.
+    """
+    try:
+        with open(cache_filename, "rb") as file:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError) as error:
+        # mmap refuses empty files with a ValueError.
+        raise CacheError("Can't read {}: {}".format(cache_filename, error))
+
+    view = memoryview(buffer)
+    try:
+        magic, version, metadata_size = HEADER.unpack_from(view)
+        if magic != MAGIC or version != VERSION:
+            raise CacheError("{} isn't a compiled table file".format(cache_filename))
+
+        start = HEADER.size
+        metadata = json.loads(str(view[start:start + metadata_size], "utf-8"))
+    except (struct.error, ValueError) as error:
+        raise CacheError("{} is damaged: {}".format(cache_filename, error))
+
+    cache_dir = os.path.dirname(os.path.abspath(cache_filename))
+    if is_stale(metadata, sources, cache_dir):
+        raise CacheError("{} is out of date".format(cache_filename))
+
+    # A cache written on a machine with a different byte order or int size is just
+    # as unusable as a stale one.
+    itemsize = array.array(ARRAY_TYPE).itemsize
+    if metadata["byteorder"] != sys.byteorder or metadata["itemsize"] != itemsize:
+        raise CacheError("{} was compiled on another platform".format(cache_filename))
+
+    count = metadata["count"]
+    start += metadata_size
+    start += -start % itemsize
+    weights_end = start + count * itemsize
+    totals_end = weights_end + count * itemsize
+    offsets_end = totals_end + (count + 1) * itemsize
+    blob_end = offsets_end + metadata["blob_size"]
+    if len(view) < blob_end:
+        raise CacheError("{} is truncated".format(cache_filename))
+
+    # The weights stay in the memory map. Unless they're lazy, the entries become
+    # Python strings, and splitting the whole blob at once is much quicker than
+    # slicing it up by offset one entry at a time. Lazy tables also draw with the
+    # running totals in the map; otherwise the tables work out their own, since
+    # searching a list is quicker than searching the map.
+    weights = view[start:weights_end].cast(ARRAY_TYPE)
+    totals = view[weights_end:totals_end].cast(ARRAY_TYPE) if lazy else None
+    if lazy:
+        offsets = view[totals_end:offsets_end].cast(ARRAY_TYPE)
+        blob = view[offsets_end:blob_end]
+    else:
+        entries = str(view[offsets_end:blob_end], "utf-8").split("\n") if count else []
+        entries = list(map(sys.intern, entries))
+
+    enum_tables = {}
+    for value, first, length in metadata["tables"]:
+        end = first + length
+        if lazy:
+            enum_tables[fields(value)] = tables.Table(
+                LazyEntries(offsets[first:end + 1], blob),
+                weights[first:end],
+                cum_weights=totals[first:end])
+        else:
+            enum_tables[fields(value)] = tables.Table(
+                entries[first:end], weights[first:end])
+
+    return enum_tables
+
+
+def is_up_to_date(cache_filename, sources):
+    """
+    Returns true if cache_filename is a compiled table file built from the current
+    contents of the source text files.
+    """
+    try:
+        with open(cache_filename, "rb") as file:
+            magic, version, metadata_size = HEADER.unpack(file.read(HEADER.size))
+            if magic != MAGIC or version != VERSION:
+                return False
+            metadata = json.loads(file.read(metadata_size).decode("utf-8"))
+    except (OSError, struct.error, ValueError):
+        return False
+
+    cache_dir = os.path.dirname(os.path.abspath(cache_filename))
+    return not is_stale(metadata, sources, cache_dir)
+
+
+def is_stale(metadata, sources, cache_dir):
+    """
+    Returns true if any of the source text files differ from the ones recorded in a
+    compiled cache's metadata.
+    """
+    stamps = metadata["sources"]
+    paths = [os.path.relpath(os.path.abspath(source), cache_dir) for source in sources]
+    if [stamp["path"] for stamp in stamps] != paths:
+        return True
+
+    for stamp in stamps:
+        source = os.path.join(cache_dir, stamp["path"])
+        try:
+            stat = os.stat(source)
+        except OSError:
+            return True
+
+        # An unchanged modification time and size is good enough. If only the time
+        # changed (a checkout, say, or a save without edits), the contents decide.
+        if stat.st_mtime_ns == stamp["mtime_ns"] and stat.st_size == stamp["size"]:
+            continue
+        if stat.st_size != stamp["size"] or file_hash(source) != stamp["sha256"]:
+            return True
+
+    return False
+
+
+def source_stamp(source, cache_dir):
+    """
+    Returns a record of a source text file's path, modification time, size and hash.
+    """
+    stat = os.stat(source)
+    return {
+        "path": os.path.relpath(os.path.abspath(source), cache_dir),
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "sha256": file_hash(source),
+    }
+
+
+def file_hash(filename):
+    """
+    Returns the SHA-256 hash of a file's contents.
+    """
+    with open(filename, "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()
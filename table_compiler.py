@@ -0,0 +1,94 @@
+import collections
+import concurrent.futures
+# Importing the generators registers the built-in table packs.
+import magic_items  # noqa: F401
+import os
+import packs
+import table_cache
+import tools
+
+# A table file to compile: the JSON file to write, the text files it's read from,
+# and a function (which has to be picklable, to run in a worker process) that reads
+# them into tables.
+CompileJob = collections.namedtuple(
+    "CompileJob", ["json_filename", "sources", "reader"])
+
+
+def pack_job(pack):
+    """
+    Returns the CompileJob for a table pack.
+    """
+    return CompileJob(pack.json_filename, pack.sources, pack.reader())
+
+
+def default_jobs():
+    """
+    Returns the CompileJobs for every registered table pack.
+    """
+    return [pack_job(pack) for pack in packs.registered_packs()]
+
+
+def is_up_to_date(job):
+    """
+    Returns true if a job's JSON file and compiled cache were both built from the
+    current contents of its text files.
+    """
+    cache_filename = tools.cache_filename(job.json_filename)
+    if not table_cache.is_up_to_date(cache_filename, job.sources):
+        return False
+
+    # The cache is also rebuilt whenever tables are loaded, so it being up to date
+    # doesn't mean the JSON file is.
+    try:
+        json_time = os.stat(job.json_filename).st_mtime_ns
+        source_time = max(os.stat(source).st_mtime_ns for source in job.sources)
+    except OSError:
+        return False
+
+    return json_time >= source_time
+
+
+def compile_job(job):
+    """
+    Reads and checks a job's text files, and writes its JSON file and compiled
+    cache. Returns the JSON filename.
+    """
+    enum_tables = job.reader()
+
+    table_cache.write_cache(
+        tools.cache_filename(job.json_filename), enum_tables, job.sources)
+    tools.save_tables(enum_tables, job.json_filename)
+
+    return job.json_filename
+
+
+def compile_tables(jobs=None, workers=None, force=False):
+    """
+    Compiles every job whose text files have changed since it was last compiled (or
+    every job, if force is true), returning the JSON filenames that were rebuilt.
+
+    Jobs are independent of each other, so they're compiled across a pool of
+    workers processes (by default, one per CPU). Raises tools.TableSourceError if
+    a text file is malformed.
+    """
+    if jobs is None:
+        jobs = default_jobs()
+
+    stale = [job for job in jobs if force or not is_up_to_date(job)]
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(stale))
+
+    # A pool isn't worth starting for a single job.
+    if workers <= 1:
+        compiled = [compile_job(job) for job in stale]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            compiled = list(executor.map(compile_job, stale))
+
+    # Anything already loaded from these files in this process is out of date now.
+    for json_filename in compiled:
+        tools.reload_tables(json_filename)
+
+    return compiled
@@ -1,4 +1,13 @@
+import array
+import bisect
+import itertools
 import random
+import sys
+
+# Frozen tables keep their weights and running totals in compact arrays of these
+# types (when the numbers fit), rather than as tuples of Python ints.
+WEIGHT_TYPE = "I"
+TOTAL_TYPE = "Q"
 
 
 class Table:
@@ -6,15 +15,213 @@ class Table:
     A table holding entries to be chosen randomly with weighted probabilities.
     """
 
-    def __init__(self, entries=None, weights=None):
-        self.entries = [] if entries is None else entries
-        self.weights = [] if weights is None else weights
+    # Long-running services hold a lot of tables, so they don't each carry a
+    # __dict__.
+    __slots__ = (
+        "rng",
+        "_entries",
+        "_weights",
+        "_cum_weights",
+        "_total",
+        "_hi",
+        "_cum_array",
+        "_frozen",
+    )
+
+    def __init__(self, entries=None, weights=None, rng=None, cum_weights=None):
+        # The random number generator to draw with when none is passed to random()
+        # or sample(). None means the random module's shared generator.
+        self.rng = rng
+        self._entries = [] if entries is None else entries
+        self._weights = [] if weights is None else weights
+        self._cum_weights = None
+        self._total = 0.0
+        self._hi = 0
+        self._cum_array = None
+        self._frozen = False
+
+        # The running totals of the weights can be handed in already worked out
+        # (say, read from a compiled table file), as long as nothing changes them.
+        if cum_weights is not None:
+            self._set_cum_weights(cum_weights)
+
+    @property
+    def entries(self):
+        return self._entries
+
+    @entries.setter
+    def entries(self, entries):
+        self._check_not_frozen()
+        self._entries = entries
+        self.invalidate()
+
+    @property
+    def weights(self):
+        return self._weights
+
+    @weights.setter
+    def weights(self, weights):
+        self._check_not_frozen()
+        self._weights = weights
+        self.invalidate()
+
+    def add(self, entry, weight):
+        """
+        Adds an entry with the given weight to the table.
+        """
+        self._check_not_frozen()
+        self._entries.append(entry)
+        self._weights.append(weight)
+        self.invalidate()
+
+    def invalidate(self):
+        """
+        Throws away the precomputed cumulative weights, so they'll be rebuilt on the
+        next draw. Call this after changing the entries or weights in place.
+        """
+        self._cum_weights = None
+        self._cum_array = None
+
+    def freeze(self):
+        """
+        Makes the table read-only, so it can safely be shared between generators.
+
+        Freezing also packs the table into as little memory as it can: text entries
+        are interned (so tables with entries in common share the strings), and the
+        weights and running totals are stored as arrays.
+        """
+        if self._frozen:
+            return self
+
+        # Weights read straight out of a compiled table file are already read-only,
+        # so there's no need to copy them.
+        if isinstance(self._entries, list):
+            self._entries = tuple([
+                sys.intern(entry) if type(entry) is str else entry
+                for entry in self._entries
+            ])
+        if isinstance(self._weights, list):
+            self._weights = compact(self._weights, WEIGHT_TYPE)
+        self._frozen = True
+
+        # Packing the weights doesn't change them, so running totals that are
+        # already worked out (or were handed in) are still good.
+        self._cum_array = None
+        cum_weights = self.cumulative_weights()
+        if isinstance(cum_weights, list):
+            self._set_cum_weights(compact(cum_weights, TOTAL_TYPE))
+
+        return self
+
+    @property
+    def frozen(self):
+        return self._frozen
+
+    def _check_not_frozen(self):
+        if self._frozen:
+            raise TypeError("Can't modify a frozen table")
+
+    def cumulative_weights(self):
+        """
+        Returns the running totals of the table's weights, building them if needed.
+        """
+        # Appending straight to the weights list (instead of going through add())
+        # changes its length, so we can catch that cheaply here too.
+        if self._cum_weights is None or len(self._cum_weights) != len(self._weights):
+            self._set_cum_weights(list(itertools.accumulate(self._weights)))
+
+        return self._cum_weights
+
+    def _set_cum_weights(self, cum_weights):
+        self._cum_weights = cum_weights
+        # These match what random.choices() computes internally, so a draw here
+        # picks exactly what random.choices() would for the same seed.
+        self._total = cum_weights[-1] + 0.0 if cum_weights else 0.0
+        self._hi = len(cum_weights) - 1
+        self._cum_array = None
 
-    def random(self):
+    def random(self, rng=None):
         """
-        Returns a random item from the table.
+        Returns a random item from the table, drawn with rng if it's given.
+
+        rng can be anything with a random() method returning a float in [0, 1), such
+        as a random.Random or a NumPy Generator.
         """
-        # Using random.choices() allows us to specify weighting. We only need 1
-        # result, so k=1, and we'll just take the first element of the (length 1)
-        # list it returns.
-        return random.choices(self.entries, self.weights, k=1)[0]
+        if rng is None:
+            rng = random if self.rng is None else self.rng
+
+        cum_weights = self._cum_weights
+        if cum_weights is None or len(cum_weights) != len(self._weights):
+            cum_weights = self.cumulative_weights()
+
+        if not cum_weights:
+            raise IndexError("Cannot choose from an empty table")
+
+        # A binary search over the precomputed running totals gives us a weighted
+        # pick in O(log n), instead of random.choices() rebuilding them every call.
+        index = bisect.bisect(cum_weights, rng.random() * self._total, 0, self._hi)
+        return self._entries[index]
+
+    def sample(self, k, rng=None):
+        """
+        Returns a list of k random items from the table, chosen with replacement and
+        drawn with rng if it's given.
+
+        If rng is a NumPy Generator, all k draws are made in one vectorised call.
+        """
+        if rng is None:
+            rng = random if self.rng is None else self.rng
+
+        cum_weights = self._cum_weights
+        if cum_weights is None or len(cum_weights) != len(self._weights):
+            cum_weights = self.cumulative_weights()
+
+        if not cum_weights and k:
+            raise IndexError("Cannot choose from an empty table")
+
+        # NumPy Generators have a bit_generator; we can search for all k picks at
+        # once instead of looping over them in Python.
+        if hasattr(rng, "bit_generator"):
+            return self._sample_numpy(k, rng)
+
+        # Pulling everything we need into locals keeps the loop as tight as it can be
+        # in pure Python. This is the same draw as random(), just k times over.
+        entries = self._entries
+        total = self._total
+        hi = self._hi
+        rand = rng.random
+        bisect_right = bisect.bisect
+
+        return [
+            entries[bisect_right(cum_weights, rand() * total, 0, hi)]
+            for _ in itertools.repeat(None, k)
+        ]
+
+    def _sample_numpy(self, k, rng):
+        """
+        Returns a list of k random items from the table, drawn with a NumPy Generator.
+        """
+        # NumPy is only needed (and only imported) if we've been handed one of its
+        # generators, so it stays an optional dependency.
+        import numpy
+
+        if self._cum_array is None:
+            self._cum_array = numpy.asarray(self._cum_weights, dtype=float)
+
+        indices = numpy.searchsorted(
+            self._cum_array, rng.random(k) * self._total, side="right")
+        numpy.minimum(indices, self._hi, out=indices)
+
+        entries = self._entries
+        return [entries[index] for index in indices.tolist()]
+
+
+def compact(numbers, typecode):
+    """
+    Returns a list of numbers as an array of the given type, or as a tuple if they
+    don't all fit in one (say, because some are negative or not whole numbers).
+    """
+    try:
+        return array.array(typecode, numbers)
+    except (OverflowError, TypeError):
+        return tuple(numbers)
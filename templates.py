@@ -4,6 +4,41 @@ class NameTemplate:
     and a string template to fill with results from those tables.
     """
 
+    __slots__ = ("fields", "string")
+
     def __init__(self, fields, string):
         self.fields = fields
         self.string = string
+
+    def compile(self, draws):
+        """
+        Returns a function that fills in this template, given a list of draws: one
+        function per slot in the string, each taking a random number generator and
+        returning the text for its slot.
+
+        The returned function takes a random number generator and returns the
+        filled-in name, without looking at the template's fields at all.
+        """
+        fill = self.string.format
+        draws = tuple(draws)
+
+        # Every template has between one and four slots, so we can unpack the draws
+        # ahead of time and skip building a list on every call.
+        if len(draws) == 1:
+            (first,) = draws
+            return lambda rng=None: fill(first(rng))
+
+        if len(draws) == 2:
+            first, second = draws
+            return lambda rng=None: fill(first(rng), second(rng))
+
+        if len(draws) == 3:
+            first, second, third = draws
+            return lambda rng=None: fill(first(rng), second(rng), third(rng))
+
+        if len(draws) == 4:
+            first, second, third, fourth = draws
+            return lambda rng=None: fill(
+                first(rng), second(rng), third(rng), fourth(rng))
+
+        return lambda rng=None: fill(*[draw(rng) for draw in draws])
@@ -1,47 +1,204 @@
 import json
+import os
+import shlex
+import table_cache
 import tables
+import threading
+import time
+import types
+
+# Every set of tables loaded through shared_tables(), keyed by the absolute path of
+# its JSON file and the enum of its fields. Generators all draw from these same
+# frozen tables instead of each loading their own copy.
+_shared_tables = {}
+_shared_tables_lock = threading.Lock()
+
+# How long each table file took to load into the shared registry, in seconds.
+load_times = {}
+
+# Whether shared tables loaded from compiled caches keep their entries in the
+# cache's memory map, decoding each one as it's drawn, rather than as strings (see
+# use_lazy_entries()).
+_lazy_entries = False
+
+
+class TableSourceError(ValueError):
+    """
+    Raised when a table text file can't be parsed, or its dice rolls don't add up.
+    """
+
+    def __init__(self, filename, line_number, problem):
+        if line_number is None:
+            location = filename
+        else:
+            location = "{}, line {}".format(filename, line_number)
+        ValueError.__init__(self, "{}: {}".format(location, problem))
+        self.filename = filename
+        self.line_number = line_number
+        self.problem = problem
+
+    def __reduce__(self):
+        # So the error survives being sent back from a worker process.
+        return TableSourceError, (self.filename, self.line_number, self.problem)
 
 
 def build_tables(json_filename, fields):
     """
-    Build tables from a text file, sorting each entry into categories based on fields.
+    Build tables from a text file, sorting each entry into categories based on fields,
+    and save them to a JSON file.
+    """
+    enum_tables = read_tables(text_filename(json_filename), fields)
+    save_tables(enum_tables, json_filename)
+
+
+def read_tables(text_filename, fields):
+    """
+    Read tables from a text file, sorting each entry into categories based on fields.
 
     The text file contains the entries from a dice roll table in the following format:
-    [number] [entry for field 1] [entry for field 2] [entry for field 3] etc.
+    [number or number range] [entry for field 1] [entry for field 2] etc.
     Example:
     42 Globe History Gyrating I- -kang
+
+    Entries are separated by spaces, so an entry with spaces in it goes in double
+    quotes:
+    61 Pride "Most Excellent" O- -nak
+
+    Raises TableSourceError if a line doesn't have an entry for every field, or the
+    numbers don't cover every roll from 1 up with no gaps or overlaps.
     """
     # Each field will get its own blank table. This variable maps enum members to
     # Table objects.
     enum_tables = {table_name: tables.Table() for table_name in fields}
+    rolls = []
 
-    # Strip the JSON extension from the filename and add a TXT extension.
-    # We do this so that build_tables can be called with the same filename used for
-    # load_tables.
-    text_filename = json_filename[:-5]
-    text_filename += ".txt"
+    for line_number, line in read_source_lines(text_filename):
+        # Only lines with quotes need the (much slower) shell-style splitting.
+        if '"' in line:
+            try:
+                entry = split_quoted(line)
+            except ValueError as error:
+                raise TableSourceError(text_filename, line_number, str(error))
+        else:
+            entry = line.split()
+
+        if len(entry) != len(enum_tables) + 1:
+            raise TableSourceError(
+                text_filename,
+                line_number,
+                "expected a roll and {} entries, found {} entries".format(
+                    len(enum_tables), len(entry) - 1))
+
+        # Get the weight for this set of entries.
+        # For ranges, weight = top - bottom + 1. For single numbers, weight = 1.
+        low, high = parse_roll(entry[0], text_filename, line_number)
+        rolls.append((low, high, line_number))
+
+        # Match each entry to its corresponding field.
+        for table, item in zip(enum_tables.values(), entry[1:]):
+            table.add(item, high - low + 1)
+
+    check_rolls(rolls, text_filename)
+
+    return enum_tables
+
+
+def split_quoted(line):
+    """
+    Splits a line of a table text file into entries at spaces, except inside double
+    quotes. Apostrophes and backslashes are just part of an entry, so entries like
+    Dragon's Fang don't need quoting.
+    """
+    lexer = shlex.shlex(line, posix=True)
+    lexer.whitespace_split = True
+    lexer.quotes = '"'
+    lexer.escape = ""
+    lexer.commenters = ""
+
+    return list(lexer)
 
+
+def read_source_lines(text_filename):
+    """
+    Yields the line number and text of each non-blank line of a table text file.
+    """
     try:
-        with open(text_filename, "r") as file:
-            for line in file:
-                cleaned_line = line.strip()
-                # Split the set of entries by field.
-                entry = cleaned_line.split(" ")
-                # Get the weight for this set of entries.
-                # For ranges, weight = top - bottom + 1. For single numbers, weight = 1.
-                weight = number_to_weight(entry[0])
-
-                # Match each entry to its corresponding field.
-                for table, item in zip(enum_tables.values(), entry[1:]):
-                    table.entries.append(item)
-                    table.weights.append(weight)
+        with open(text_filename, "r", encoding="utf-8") as file:
+            for line_number, line in enumerate(file, 1):
+                line = line.strip()
+                if line:
+                    yield line_number, line
 
     except FileNotFoundError:
         raise FileNotFoundError(
             "Couldn't find a text file named {} with table data!".format(text_filename)
         )
 
-    save_tables(enum_tables, json_filename)
+
+def parse_roll(number_string, text_filename=None, line_number=None):
+    """
+    Returns the low and high end of a roll, which is either a single number or a
+    range like 03-12.
+    """
+    try:
+        if "-" in number_string:
+            low, high = number_string.split("-")
+            low, high = int(low), int(high)
+        else:
+            low = high = int(number_string)
+    except ValueError:
+        raise TableSourceError(
+            text_filename,
+            line_number,
+            "{} isn't a number or range of numbers".format(number_string))
+
+    if low > high:
+        raise TableSourceError(
+            text_filename, line_number, "{} is backwards".format(number_string))
+
+    return low, high
+
+
+def check_rolls(rolls, text_filename):
+    """
+    Raises TableSourceError unless the (low, high, line number) rolls of a table
+    cover every number from 1 up, in order, with no gaps or overlaps.
+    """
+    expected = 1
+    for low, high, line_number in rolls:
+        if low > expected:
+            raise TableSourceError(
+                text_filename,
+                line_number,
+                "nothing covers {}".format(
+                    expected if low == expected + 1
+                    else "{}-{}".format(expected, low - 1)))
+        if low < expected:
+            raise TableSourceError(
+                text_filename,
+                line_number,
+                "{} is already covered by an earlier line".format(low))
+        expected = high + 1
+
+    if not rolls:
+        raise TableSourceError(text_filename, None, "there are no entries")
+
+
+def text_filename(json_filename):
+    """
+    Returns the name of the text file a JSON table file is built from.
+    """
+    # Strip the JSON extension from the filename and add a TXT extension.
+    # We do this so that build_tables can be called with the same filename used for
+    # load_tables.
+    return json_filename[:-5] + ".txt"
+
+
+def cache_filename(json_filename):
+    """
+    Returns the name of the compiled cache file for a JSON table file.
+    """
+    return json_filename[:-5] + table_cache.EXTENSION
 
 
 def save_tables(enum_tables, filename):
@@ -53,7 +210,7 @@ def save_tables(enum_tables, filename):
     for label, inner_table in enum_tables.items():
         json_tables[label.value] = {
             'entries': inner_table.entries,
-            'weights': inner_table.weights}
+            'weights': list(inner_table.weights)}
 
     with open(filename, "w") as file:
         json.dump(json_tables, file)
@@ -62,7 +219,7 @@ def save_tables(enum_tables, filename):
 def load_tables(filename, fields):
     """
     Load tables from a JSON file, adjusting their keys to be enum members and their
-    values to be Table objects.
+    values to be frozen Table objects.
     """
     try:
         with open(filename, "r") as file:
@@ -74,12 +231,13 @@ def load_tables(filename, fields):
     # enum members from fields.
     labeled = {fields(int(num)): table for num, table in json_tables.items()}
 
-    # Build Table objects with the entries and weights for each field.
+    # Build Table objects with the entries and weights for each field, frozen so
+    # they can be shared between generators.
     enum_tables = {}
     for label, inner_table in labeled.items():
         enum_tables[label] = tables.Table(
             inner_table['entries'],
-            inner_table['weights'])
+            inner_table['weights']).freeze()
 
     return enum_tables
 
@@ -88,11 +246,25 @@ def build_item_tables(json_filename, item_filenames, fields):
     """
     Build item tables from a list of multiple text files (one text file per item
     subtype), then save the resulting tables as JSON using the provided filename.
+    """
+    enum_tables = read_item_tables(item_filenames, fields)
+
+    # Save the resulting object to a JSON file for later use.
+    save_tables(enum_tables, json_filename)
+
+
+def read_item_tables(item_filenames, fields):
+    """
+    Read item tables from a list of multiple text files (one text file per item
+    subtype).
 
     The text files contain entries from a dice roll table in the following format:
     [number or number range] [item type]
     Example:
     42-46 Hammer
+
+    Raises TableSourceError if the numbers in a file don't cover every roll from 1
+    up with no gaps or overlaps.
     """
     # Build each table, adding it to a containing dictionary with an appropriate key.
     enum_tables = {table_name: tables.Table() for table_name in fields}
@@ -100,27 +272,22 @@ def build_item_tables(json_filename, item_filenames, fields):
     # Because enum_tables and item_filenames were both built from an enum, they have
     # a predictable, repeatable order. That means we can match them up with zip().
     for item_table, item_file in zip(enum_tables.values(), item_filenames):
-        try:
-            with open(item_file, "r") as file:
-                for line in file:
-                    cleaned_line = line.strip()
-                    # Split the entries into a number (or number range) and an item.
-                    entry = cleaned_line.split(" ")
-                    # Get the weight for this set of entries.
-                    # For ranges, weight = top - bottom + 1. For single numbers,
-                    # weight = 1.
-                    weight = number_to_weight(entry[0])
-                    # Get the specific item.
-                    item = entry[1]
-
-                    item_table.entries.append(item)
-                    item_table.weights.append(weight)
-
-        except FileNotFoundError:
-            raise FileNotFoundError("No text file named {}!".format(item_file))
+        rolls = []
+        for line_number, line in read_source_lines(item_file):
+            # Split the line into a number (or number range) and an item, which is
+            # the whole rest of the line (like "Looking Glass").
+            number_string, _, item = line.partition(" ")
+            item = item.strip()
+            if not item:
+                raise TableSourceError(item_file, line_number, "there's no item")
 
-    # Save the resulting object to a JSON file for later use.
-    save_tables(enum_tables, json_filename)
+            low, high = parse_roll(number_string, item_file, line_number)
+            rolls.append((low, high, line_number))
+            item_table.add(item, high - low + 1)
+
+        check_rolls(rolls, item_file)
+
+    return enum_tables
 
 
 def number_to_weight(number_string):
@@ -128,12 +295,104 @@ def number_to_weight(number_string):
     Returns 1 if number_string is a single number, or high end - low end + 1 if
     number_string is a range.
     """
-    if "-" in number_string:
-        number_range = number_string.split("-")
-        low = int(number_range[0])
-        high = int(number_range[1])
-        weight = high - low + 1
-    else:
-        weight = 1
+    low, high = parse_roll(number_string)
+
+    return high - low + 1
+
+
+def shared_tables(filename, fields, build=None, sources=None, reader=None, exclude=()):
+    """
+    Returns the frozen tables in filename, loading them the first time they're asked
+    for and handing back the same tables every time after that.
+
+    If the text files the tables come from are given as sources, along with a reader
+    that parses them into tables, the tables are loaded from a compiled cache that is
+    rebuilt whenever the sources change, and the JSON file isn't used at all.
+    Otherwise they're loaded from the JSON file, and if that doesn't exist and build
+    is given, build is called (with no arguments) to create it first.
+
+    Any fields in exclude are left out, even if the files have tables for them (say,
+    files written before those fields were shared from another pack).
+    """
+    key = (os.path.abspath(filename), fields)
+
+    with _shared_tables_lock:
+        if key not in _shared_tables:
+            start = time.perf_counter()
+            if sources and all(os.path.exists(source) for source in sources):
+                enum_tables = table_cache.load_tables(
+                    cache_filename(filename),
+                    sources,
+                    fields,
+                    reader,
+                    lazy=_lazy_entries)
+            else:
+                try:
+                    enum_tables = load_tables(filename, fields)
+                except FileNotFoundError:
+                    if build is None:
+                        raise
+                    build()
+                    enum_tables = load_tables(filename, fields)
+
+            if exclude:
+                enum_tables = {
+                    field: table
+                    for field, table in enum_tables.items()
+                    if field not in exclude
+                }
+
+            for table in enum_tables.values():
+                table.freeze()
+
+            # A read-only view, so one generator can't swap out another's tables.
+            _shared_tables[key] = types.MappingProxyType(enum_tables)
+            load_times[filename] = time.perf_counter() - start
+
+        return _shared_tables[key]
+
+
+def use_lazy_entries(lazy=True):
+    """
+    Sets whether shared tables loaded from now on read their entries lazily from
+    their compiled cache's memory map (see table_cache.LazyEntries).
+
+    Every process that maps the same cache file shares the same pages of memory, so
+    with lazy entries a process holds no copy of the tables of its own, at the cost
+    of decoding each entry as it's drawn. That suits worker processes, whose memory
+    then stays flat however many of them there are. Tables already loaded aren't
+    affected until they're reloaded.
+    """
+    global _lazy_entries
+    _lazy_entries = lazy
+
+
+def reload_tables(filename=None):
+    """
+    Forgets the shared tables loaded from filename (or all of them, if no filename is
+    given), so they're read from disk again the next time they're asked for.
+
+    Generators that already hold the old tables keep using them until they reload.
+    """
+    with _shared_tables_lock:
+        if filename is None:
+            _shared_tables.clear()
+            return
+
+        path = os.path.abspath(filename)
+        for key in [key for key in _shared_tables if key[0] == path]:
+            del _shared_tables[key]
+
+
+def shared_table_names():
+    """
+    Returns a dictionary mapping each shared table to a name made from its file and
+    field, like "Spells.json:ADJECTIVE".
+    """
+    names = {}
+    with _shared_tables_lock:
+        for (path, _), enum_tables in _shared_tables.items():
+            for field, table in enum_tables.items():
+                names[table] = "{}:{}".format(os.path.basename(path), field.name)
 
-    return weight
+    return names
@@ -0,0 +1,179 @@
+import hashlib
+import itertools
+import math
+
+# How many names to ask for at a time while filling up a unique run.
+CHUNK_SIZE = 10000
+
+# The largest fraction of the name space a unique run can ask for. Past this, random
+# draws spend most of their time landing on names we already have.
+MAX_FILL = 0.9
+
+# How many duplicate draws in a row we'll put up with before deciding the name space
+# is used up (say, because a Bloom filter has filled up with false positives).
+MAX_MISSES = 100000
+
+# The default chance of a Bloom filter wrongly reporting a new name as seen.
+BLOOM_ERROR_RATE = 0.001
+
+DEDUP_METHODS = ["exact", "bloom"]
+
+
+class NameSpaceExhausted(ValueError):
+    """
+    Raised when more unique names are asked for than can reasonably be generated.
+    """
+
+
+class SeenSet:
+    """
+    Remembers exactly which names have been seen, by keeping the names themselves.
+    """
+
+    def __init__(self):
+        self.names = set()
+
+    def add(self, name):
+        """
+        Adds name to the set, returning true if it hadn't been seen before.
+        """
+        # Checking the length is one lookup instead of the two that "in" then add()
+        # would take.
+        names = self.names
+        size = len(names)
+        names.add(name)
+        return len(names) != size
+
+    def __len__(self):
+        return len(self.names)
+
+
+class BloomFilter:
+    """
+    Remembers which names have been seen in a fixed amount of memory, at the cost of
+    sometimes wrongly reporting a new name as seen (which just means it's skipped).
+    """
+
+    def __init__(self, capacity, error_rate=BLOOM_ERROR_RATE):
+        capacity = max(capacity, 1)
+        # The standard sizing for a Bloom filter holding capacity items with the
+        # given false positive rate.
+        self.num_bits = max(
+            8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.num_hashes = max(
+            1, int(round(self.num_bits / capacity * math.log(2))))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def add(self, name):
+        """
+        Adds name to the filter, returning true if it (probably) hadn't been seen
+        before.
+        """
+        # Two hashes from one digest give us as many as we need, by combining them
+        # as first + i * second.
+        digest = hashlib.blake2b(name.encode("utf-8"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+
+        bits = self.bits
+        new = False
+        for i in range(self.num_hashes):
+            bit = (first + i * second) % self.num_bits
+            byte, mask = bit >> 3, 1 << (bit & 7)
+            if not bits[byte] & mask:
+                bits[byte] |= mask
+                new = True
+
+        if new:
+            self.count += 1
+        return new
+
+    def __len__(self):
+        return self.count
+
+
+def make_seen_set(method, capacity):
+    """
+    Returns an empty seen-set using the given dedup method ("exact" or "bloom"), sized
+    for capacity names.
+    """
+    if method == "exact":
+        return SeenSet()
+    if method == "bloom":
+        return BloomFilter(capacity)
+
+    raise ValueError("Unknown dedup method {}!".format(method))
+
+
+def check_capacity(total, space_size, max_fill=MAX_FILL):
+    """
+    Raises NameSpaceExhausted if total unique names is more than space_size distinct
+    names can reasonably supply.
+    """
+    if total > space_size:
+        raise NameSpaceExhausted(
+            "Can't generate {} unique names: there are only {} possible.".format(
+                total, space_size))
+
+    if total > space_size * max_fill:
+        raise NameSpaceExhausted(
+            "Can't generate {} unique names: that's more than {:.0%} of the {} "
+            "possible, so it would take far too long.".format(
+                total, max_fill, space_size))
+
+
+def unique(
+        generate,
+        total,
+        space_size,
+        method="exact",
+        seen=None,
+        chunk_size=CHUNK_SIZE,
+        max_fill=MAX_FILL,
+        max_misses=MAX_MISSES,
+        sampler=None):
+    """
+    Yields total distinct results from generate, a function that takes a count and
+    returns a list of that many names (or GeneratedName records).
+
+    space_size is how many distinct names generate can produce; asking for too large
+    a share of them fails straight away with NameSpaceExhausted. seen can be an
+    existing SeenSet or BloomFilter to dedup against, otherwise a new one is made
+    using method.
+
+    sampler can be a function returning an iterator of distinct results (like a
+    sampling.RankSampler), which is then used for the whole run instead of
+    generate. It's far quicker for big runs and can use up the whole name space,
+    but a RankSampler ignores the weights of the entries within each template, so
+    the names come out differently distributed; callers have to ask for it.
+    """
+    if sampler is not None and seen is None:
+        check_capacity(total, space_size, max_fill=1)
+        yield from itertools.islice(sampler(), total)
+        return
+
+    check_capacity(total, space_size, max_fill)
+
+    if seen is None:
+        seen = make_seen_set(method, total)
+
+    remaining = total
+    misses = 0
+    while remaining > 0:
+        for result in generate(min(chunk_size, remaining)):
+            name = getattr(result, "name", result)
+            if not seen.add(name):
+                misses += 1
+                if misses > max_misses:
+                    raise NameSpaceExhausted(
+                        "Gave up after {} duplicate names in a row, with {} of {} "
+                        "unique names generated.".format(
+                            misses, total - remaining, total))
+                continue
+
+            misses = 0
+            yield result
+            remaining -= 1
+            if not remaining:
+                return